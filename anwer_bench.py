@@ -0,0 +1,440 @@
+"""قياس أداء مسار الرسالة ← التنبيه في Anwer
+
+يمرّر رسائل مُولّدة (عربية وإنجليزية) عبر المعالج الحقيقي anwer_message_handler بعميل تليجرام
+وهمي، ويقيس الحفظ في مخزن التنبيهات وتحميل الإعدادات مع نمو السجل. كل سيناريو يعمل في عملية
+مستقلة ومجلد مؤقت، والنتائج تُكتب بصيغة JSON Lines لمقارنتها بين الإصدارات:
+
+    python anwer_bench.py --output base.jsonl
+    python anwer_bench.py --output new.jsonl --compare base.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ANWER_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# مفردات الرسائل المُولّدة: كلمات الحشو تملأ الرسائل، والكلمات المراقبة تُبنى من أزواج كلمات
+# المواضيع فقط حتى لا تتطابق الرسائل مع الكلمات المراقبة صدفة وتبقى نسبة المطابقة كما طُلبت
+ANWER_BENCH_CORPORA = {
+    "arabic": {
+        "filler": (
+            "السلام عليكم مرحبا يا شباب هل احد يعرف كيف اين متى لماذا من فضلكم شكرا جزاكم الله خيرا "
+            "انا انت هو هي نحن هم هذا هذه ذلك تلك في على الى من عن مع بعد قبل عند كل بعض اي "
+            "اليوم امس غدا الان صباح مساء ليلة ساعة دقيقة اسبوع شهر سنة قريبا دائما احيانا ابدا "
+            "كان يكون صار اصبح ليس قال يقول ذهب جاء رجع كتب قرأ سمع شاف عرف فهم نسي تذكر حاول "
+            "كبير صغير جديد قديم جميل سهل صعب مهم كثير قليل اول اخر افضل اكثر اقل جيد سيء "
+            "بيت سيارة طريق مدينة سوق مطعم قهوة شاي ماء اكل صديق اخ اخت ام اب عائلة ناس الجميع"
+        ).split(),
+        "topics": (
+            "حل واجب بحث تقرير مشروع تخرج اختبار نهائي ملخص شرح محاضرة تكليف تسليم مراجعة "
+            "تصميم ترجمة تدقيق برمجة تحليل احصاء رياضيات فيزياء كيمياء احياء محاسبة تسويق قانون "
+            "ادارة اقتصاد هندسة طب صيدلة تمريض لغة انجليزي فرنسي برزنتيشن عرض_تقديمي خريطة_ذهنية "
+            "سيرة_ذاتية خطاب توصية منحة قبول تسجيل مقرر جدول درجات معدل رسالة ماجستير دكتوراه "
+            "خطة استبيان مقال ورقة بحثية تلخيص كتاب رواية قصة شعر نحو صرف بلاغة منطق فلسفة "
+            "علم نفس اجتماع تاريخ جغرافيا اسلامية حاسب شبكات امن معلومات ذكاء اصطناعي قواعد بيانات"
+        ).split()
+    },
+    "english": {
+        "filler": (
+            "hello hi guys does anyone know how where when why please thanks thank you so much "
+            "i you he she we they this that these those in on at to from about with after before "
+            "every some any today yesterday tomorrow now morning evening night hour minute week "
+            "month year soon always sometimes never was is are be been said says went came back "
+            "wrote read heard saw knew understood forgot remembered tried big small new old nice "
+            "easy hard important many few first last best more less good bad house car road city "
+            "market restaurant coffee tea water food friend brother sister mother father family people"
+        ).split(),
+        "topics": (
+            "assignment homework essay report project thesis exam final summary lecture coursework "
+            "submission revision design translation proofreading programming analysis statistics "
+            "math physics chemistry biology accounting marketing law management economics engineering "
+            "medicine pharmacy nursing english french presentation mindmap resume cover_letter "
+            "recommendation scholarship admission registration syllabus schedule grades gpa dissertation "
+            "masters phd plan survey article paper research abstract book novel story poetry grammar "
+            "rhetoric logic philosophy psychology sociology history geography computing networks "
+            "security cybersecurity ai machine_learning databases calculus algebra"
+        ).split()
+    }
+}
+
+# المقاييس المقارنة بين تشغيلين: (اسم المقياس، الأعلى أفضل)
+ANWER_BENCH_COMPARE_METRICS = {
+    "pipeline": (("handler_eps", True), ("message_us", False), ("p50_us", False), ("p99_us", False)),
+    "store": (("save_eps", True), ("query_p99_us", False), ("settings_cold_p99_us", False))
+}
+
+def anwer_bench_keywords(rng, corpus, count):
+    """كلمات مراقبة فريدة من زوج كلمات مواضيع (مثل "حل واجب")"""
+    words = ANWER_BENCH_CORPORA[corpus]["topics"]
+    pairs = [f"{a} {b}" for a in words for b in words if a != b]
+    if count > len(pairs):
+        raise ValueError(f"المفردات تكفي {len(pairs)} كلمة مراقبة فقط")
+    return rng.sample(pairs, count)
+
+def anwer_bench_message(rng, corpus, keyword=None):
+    """رسالة عشوائية من 8 إلى 30 كلمة، تتضمن الكلمة المراقبة إذا أُعطيت"""
+    words = rng.choices(ANWER_BENCH_CORPORA[corpus]["filler"], k=rng.randint(8, 30))
+    if keyword:
+        words.insert(rng.randrange(len(words) + 1), keyword)
+    return " ".join(words)
+
+def anwer_percentile(values, fraction):
+    """قيمة النسبة المئوية من قائمة مرتبة"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def anwer_latency_summary(prefix, latencies):
+    """p50/p99/max بالميكروثانية"""
+    latencies = sorted(latencies)
+    return {
+        f"{prefix}p50_us": round(anwer_percentile(latencies, 0.5) * 1e6, 1),
+        f"{prefix}p99_us": round(anwer_percentile(latencies, 0.99) * 1e6, 1),
+        f"{prefix}max_us": round(latencies[-1] * 1e6, 1) if latencies else 0.0
+    }
+
+def anwer_bench_import(workdir):
+    """استيراد anwer_bot داخل مجلد مؤقت حتى لا تُمس بيانات المستخدمين الحقيقية"""
+    # السجل الكامل مطلوب لقياس 1M تنبيه، لذا يُلغى حد الاحتفاظ لكل مستخدم
+    os.environ["ANWER_ALERTS_MAX_PER_USER"] = "0"
+    os.chdir(workdir)
+    sys.path.insert(0, ANWER_REPO_DIR)
+    import anwer_bot
+    # سطر سجل لكل تنبيه يطغى على زمن المسار نفسه
+    logging.disable(logging.INFO)
+    return anwer_bot
+
+async def anwer_bench_pipeline(bot, params):
+    """تمرير رسائل مُولّدة عبر معالج المراقبة الحقيقي لعدة مستخدمين"""
+    import anwer_fake_telegram
+    from anwer_fake_telegram import AnwerFakeMessage, AnwerFakeTelegram, anwer_fake_client_factory
+
+    rng = random.Random(params["seed"])
+    corpus = params["corpus"]
+    user_ids = [f"bench-{i}" for i in range(params["users"])]
+
+    # fanout > 1: نفس رسالة المجموعة الكبيرة تصل لعدة حسابات (كما يحدث عندما يشترك حساباتنا في نفس المجموعات)
+    fanout = min(params.get("fanout", 1), len(user_ids))
+    # خادم وهمي بلا أعطال: المحادثات مجموعات عادية، أو مجموعات كبيرة عند fanout > 1
+    backend = AnwerFakeTelegram(
+        dialogs=0, flood_wait_rate=0, send_latency=params["send_latency_ms"] / 1000, seed=params["seed"]
+    )
+    backend.add_chats(50, "megagroup" if fanout > 1 else "group")
+    anwer_fake_telegram.anwer_fake_backend = backend
+
+    handlers = []
+    keyword_sets = []
+    for user_id in user_ids:
+        settings = bot.anwer_default_user_settings()
+        settings["keywords"] = anwer_bench_keywords(rng, corpus, params["keywords"])
+        bot.anwer_save_user_settings(user_id, settings)
+        keyword_sets.append(settings["keywords"])
+
+        client = anwer_fake_client_factory(user_id, 1, "bench")
+        await client.connect()
+        bot.anwer_clients[user_id] = client
+        # بدون حد إرسال ومحادثة التنبيهات محلولة مسبقاً: القياس لمسار Anwer لا لحدود تليجرام
+        bot.anwer_rate_limiters[user_id] = bot.AnwerTokenBucket(1e12, 1e12)
+        bot.anwer_notification_targets[user_id] = (settings["notifications_chat"], "bench-target")
+        bot.anwer_start_monitoring_task(user_id)
+
+    await asyncio.sleep(0)
+    for user_id in user_ids:
+        handlers.append(next(
+            callback for callback, event in bot.anwer_clients[user_id].handlers if event is bot.events.NewMessage
+        ))
+
+    work = []
+    for i in range(params["messages"]):
+        user_index = i % len(user_ids)
+        keyword = rng.choice(keyword_sets[user_index]) if rng.random() < params["match_ratio"] else None
+        message = AnwerFakeMessage(
+            i + 1, rng.choice(backend.chats), rng.choice(backend.senders), anwer_bench_message(rng, corpus, keyword)
+        )
+        for offset in range(fanout):
+            work.append((handlers[(user_index + offset) % len(user_ids)], SimpleNamespace(message=message)))
+
+    if params["trace_memory"]:
+        tracemalloc.start()
+
+    latencies = []
+    started_at = time.perf_counter()
+    for handler, event in work:
+        event_started_at = time.perf_counter()
+        await handler(event)
+        latencies.append(time.perf_counter() - event_started_at)
+        # إتاحة الفرصة لعمال الإرسال كما يحدث بين أحداث تليجرام الحقيقية
+        await asyncio.sleep(0)
+    handled_at = time.perf_counter()
+
+    await asyncio.gather(*(bot.anwer_alert_queues[user_id].join() for user_id in user_ids))
+    bot.anwer_flush_alerts()
+    finished_at = time.perf_counter()
+
+    result = {
+        "events": len(work),
+        "message_us": round((handled_at - started_at) / params["messages"] * 1e6, 1),
+        "matched": sum(bot.anwer_message_metrics[user_id].matched for user_id in user_ids),
+        "handler_eps": round(len(work) / (handled_at - started_at), 1),
+        "end_to_end_eps": round(len(work) / (finished_at - started_at), 1),
+        **anwer_latency_summary("", latencies)
+    }
+    for key in ("sent", "batched", "dropped", "suppressed", "failed"):
+        result[key] = sum(getattr(bot.anwer_get_dispatch_stats(user_id), key) for user_id in user_ids)
+    if params["trace_memory"]:
+        result["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    for user_id in user_ids:
+        await bot.anwer_clients[user_id].disconnect()
+    await asyncio.gather(*bot.anwer_monitoring_tasks.values(), return_exceptions=True)
+    return result
+
+def anwer_bench_store(bot, params):
+    """حفظ التنبيهات وقراءتها وتحميل الإعدادات مع سجل تنبيهات بحجم معيّن"""
+    rng = random.Random(params["seed"])
+    corpus = params["corpus"]
+    user_id = "bench-0"
+    bot.anwer_save_user_settings(user_id, bot.anwer_default_user_settings())
+
+    def alert():
+        return bot.anwer_build_alert_data(
+            [rng.choice(ANWER_BENCH_CORPORA[corpus]["topics"])], anwer_bench_message(rng, corpus),
+            {"name": "bench", "username": "bench"},
+            {"title": "مجموعة", "id": rng.randrange(50), "link": "", "link_type": "public"}
+        )
+
+    # تعبئة السجل على دفعات كبيرة (خارج القياس) عبر مسار الكتابة الحقيقي حتى يُملأ البحث
+    # وفهرس الكلمات والإحصائيات مثل سجل فعلي
+    remaining = params["history"]
+    while remaining > 0:
+        chunk = min(remaining, 10000)
+        bot.anwer_alert_write_buffer.extend(bot.anwer_alert_row(user_id, alert()) for _ in range(chunk))
+        if not bot.anwer_flush_alerts():
+            raise RuntimeError("فشل تعبئة سجل التنبيهات")
+        remaining -= chunk
+
+    if params["trace_memory"]:
+        tracemalloc.start()
+
+    alerts = [alert() for _ in range(params["alerts"])]
+    save_latencies = []
+    started_at = time.perf_counter()
+    for item in alerts:
+        save_started_at = time.perf_counter()
+        bot.anwer_save_alert(user_id, item)
+        save_latencies.append(time.perf_counter() - save_started_at)
+    bot.anwer_flush_alerts()
+    saved_at = time.perf_counter()
+
+    query_latencies = []
+    for _ in range(params["repeats"]):
+        query_started_at = time.perf_counter()
+        bot.anwer_query_user_alerts(user_id, limit=50)
+        query_latencies.append(time.perf_counter() - query_started_at)
+
+    count_latencies = []
+    for _ in range(params["repeats"]):
+        count_started_at = time.perf_counter()
+        bot.anwer_count_user_alerts(user_id)
+        count_latencies.append(time.perf_counter() - count_started_at)
+
+    cold_latencies = []
+    warm_latencies = []
+    for _ in range(params["repeats"]):
+        bot.anwer_settings_cache.pop(user_id, None)
+        settings_started_at = time.perf_counter()
+        bot.anwer_load_user_settings(user_id)
+        cold_latencies.append(time.perf_counter() - settings_started_at)
+        settings_started_at = time.perf_counter()
+        bot.anwer_load_user_settings(user_id)
+        warm_latencies.append(time.perf_counter() - settings_started_at)
+
+    result = {
+        "save_eps": round(len(alerts) / (saved_at - started_at), 1),
+        **anwer_latency_summary("save_", save_latencies),
+        **anwer_latency_summary("query_", query_latencies),
+        **anwer_latency_summary("count_", count_latencies),
+        **anwer_latency_summary("settings_cold_", cold_latencies),
+        **anwer_latency_summary("settings_warm_", warm_latencies)
+    }
+    if params["trace_memory"]:
+        result["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return result
+
+def anwer_bench_run(params):
+    """تشغيل سيناريو واحد (داخل العملية الفرعية) وإرجاع نتيجته"""
+    with tempfile.TemporaryDirectory(prefix="anwer_bench_") as workdir:
+        bot = anwer_bench_import(workdir)
+        if params["benchmark"] == "pipeline":
+            result = asyncio.run(anwer_bench_pipeline(bot, params))
+        else:
+            result = anwer_bench_store(bot, params)
+        bot.anwer_alerts_db.close()
+        os.chdir(ANWER_REPO_DIR)
+
+    if resource is not None:
+        # بالكيلوبايت على لينكس
+        result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def anwer_bench_scenarios(args):
+    """السيناريوهات: كل محور يتغيّر وحده والبقية على القيمة الأساسية"""
+    common = {
+        "messages": args.messages,
+        "match_ratio": args.match_ratio,
+        "send_latency_ms": args.send_latency_ms,
+        "alerts": args.alerts,
+        "repeats": args.repeats,
+        "seed": args.seed,
+        "trace_memory": args.trace_memory
+    }
+    base_fanout = args.fanout[0]
+    base_keywords, base_users = args.keywords[0], args.users[0]
+
+    for corpus in args.corpus:
+        pipeline = [(keywords, base_users, base_fanout) for keywords in args.keywords]
+        pipeline += [(base_keywords, users, base_fanout) for users in args.users[1:]]
+        # تكلفة الرسالة مع ازدياد عدد الحسابات التي تراها (عدد المستخدمين = عدد الحسابات)
+        pipeline += [(base_keywords, fanout, fanout) for fanout in args.fanout[1:]]
+        for keywords, users, fanout in pipeline:
+            yield {"benchmark": "pipeline", "corpus": corpus, "keywords": keywords, "users": users,
+                   "fanout": fanout, **common}
+
+        for history in args.history:
+            yield {"benchmark": "store", "corpus": corpus, "history": history, **common}
+
+def anwer_bench_scenario_key(params):
+    """مفتاح السيناريو للمقارنة (بدون خيارات القياس نفسها)"""
+    return json.dumps({k: v for k, v in params.items() if k != "trace_memory"}, sort_keys=True)
+
+def anwer_bench_spawn(params):
+    """تشغيل سيناريو في عملية مستقلة: ذاكرة وحالة نظيفة لكل قياس"""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run", json.dumps(params)],
+        capture_output=True, text=True, cwd=ANWER_REPO_DIR
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "no output"}
+    return json.loads(lines[-1])
+
+def anwer_bench_meta():
+    """معلومات التشغيل المرفقة بكل نتيجة"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ANWER_REPO_DIR
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def anwer_bench_compare(results, baseline_file, threshold):
+    """مقارنة النتائج بتشغيل سابق، وإرجاع عدد التراجعات التي تتجاوز الحد"""
+    baseline = {}
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[anwer_bench_scenario_key(record["params"])] = record["result"]
+
+    regressions = 0
+    for record in results:
+        params = record["params"]
+        old = baseline.get(anwer_bench_scenario_key(params))
+        if old is None or "error" in old or "error" in record["result"]:
+            continue
+
+        for metric, higher_is_better in ANWER_BENCH_COMPARE_METRICS[params["benchmark"]]:
+            old_value, new_value = old.get(metric), record["result"].get(metric)
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            regressed = -change > threshold if higher_is_better else change > threshold
+            regressions += regressed
+            label = {k: v for k, v in params.items() if k in ("benchmark", "corpus", "keywords", "users", "fanout", "history")}
+            print(f"{'REGRESSION' if regressed else 'ok':10} {metric:22} {old_value:>12} -> {new_value:>12} "
+                  f"({change:+.1%}) {label}", file=sys.stderr)
+    return regressions
+
+def anwer_int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء مسار الرسالة ← التنبيه في Anwer")
+    parser.add_argument("--keywords", type=anwer_int_list, default=[10, 100, 1000, 5000],
+                        help="عدد الكلمات المراقبة لكل مستخدم (الأولى هي القيمة الأساسية)")
+    parser.add_argument("--users", type=anwer_int_list, default=[1, 10, 100, 500],
+                        help="عدد المستخدمين (الأولى هي القيمة الأساسية)")
+    parser.add_argument("--fanout", type=anwer_int_list, default=[1, 10, 100],
+                        help="عدد الحسابات التي تصلها نفس الرسالة (الأولى هي القيمة الأساسية)")
+    parser.add_argument("--history", type=anwer_int_list, default=[0, 10000, 100000, 1000000],
+                        help="حجم سجل التنبيهات لقياس المخزن")
+    parser.add_argument("--corpus", type=lambda v: v.split(","), default=["arabic", "english"])
+    parser.add_argument("--messages", type=int, default=20000, help="عدد الرسائل لكل سيناريو")
+    parser.add_argument("--match-ratio", type=float, default=0.05, help="نسبة الرسائل المطابقة")
+    parser.add_argument("--send-latency-ms", type=float, default=0.0, help="زمن إرسال وهمي لكل تنبيه")
+    parser.add_argument("--alerts", type=int, default=5000, help="عدد التنبيهات المحفوظة في قياس المخزن")
+    parser.add_argument("--repeats", type=int, default=50, help="تكرار قياسات القراءة")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="قياس ذروة الذاكرة بـ tracemalloc (أبطأ)")
+    parser.add_argument("--quick", action="store_true", help="سيناريوهات مصغّرة للتحقق السريع")
+    parser.add_argument("--output", help="ملف النتائج (JSON Lines)، الافتراضي stdout")
+    parser.add_argument("--compare", help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--threshold", type=float, default=0.2, help="نسبة التراجع المسموحة عند المقارنة")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(anwer_bench_run(json.loads(args.run))))
+        return 0
+
+    if args.quick:
+        args.keywords, args.users, args.fanout, args.history = [10, 1000], [1, 20], [1, 20], [0, 10000]
+        args.messages, args.alerts, args.repeats = 2000, 1000, 10
+
+    meta = anwer_bench_meta()
+    results = []
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for params in anwer_bench_scenarios(args):
+            started_at = time.perf_counter()
+            record = {"params": params, "result": anwer_bench_spawn(params), "meta": meta}
+            results.append(record)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            print(f"{params['benchmark']} {params['corpus']} "
+                  f"{ {k: params[k] for k in ('keywords', 'users', 'fanout', 'history') if k in params} } "
+                  f"{time.perf_counter() - started_at:.1f}s", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.compare:
+        return 1 if anwer_bench_compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
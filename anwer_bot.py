@@ -1,29 +1,71 @@
 import asyncio
+import bisect
+import copy
+import csv
+import hashlib
+import heapq
+import hmac
+import html
+import importlib
+import io
 import json
 import logging
 import os
-from datetime import datetime
+import random
+import re
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse
-from fastapi.templating import Jinja2Templates
-from server import keep_alive
-import zipfile
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from telethon import TelegramClient, events
-from telethon.tl.types import Channel, Chat
-from telethon.errors import FloodWaitError, AuthKeyUnregisteredError
+from telethon.tl.types import Channel, Chat, PeerChannel, PeerChat, UpdateChannel, UpdateChat, UpdateUserName
+from telethon.errors import (
+    FloodWaitError, AuthKeyUnregisteredError, PeerIdInvalidError, ChannelPrivateError,
+    UserIsBlockedError, InputUserDeactivatedError
+)
+from telethon.utils import get_input_peer, get_peer_id, resolve_id
 import uvicorn
 import uuid
 from pathlib import Path
 import sqlite3
 import time
-import signal
 import threading
+import zlib
+try:
+    from re import _parser as anwer_re_parser
+except ImportError:
+    # بايثون 3.10 وما قبلها
+    import sre_parse as anwer_re_parser
+from anwer_status_page import anwer_render_status_page
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-templates = Jinja2Templates(directory="anwer_templates")
+@asynccontextmanager
+async def anwer_lifespan(app):
+    """تشغيل المهام الخلفية عند بدء التطبيق وإيقافها عند الإغلاق"""
+    anwer_readiness["stage"] = "alerts_db"
+    anwer_init_alerts_db()
+    restore_task = asyncio.create_task(anwer_restore_sessions())
+    anwer_background_tasks.update({
+        "alert_flush": asyncio.create_task(anwer_alert_flush_loop()),
+        "health_supervisor": asyncio.create_task(anwer_health_supervisor()),
+        "auto_send_scheduler": asyncio.create_task(anwer_auto_send_scheduler()),
+        "chat_positions": asyncio.create_task(anwer_chat_positions_save_loop())
+    })
+    try:
+        yield
+    finally:
+        restore_task.cancel()
+        for task in anwer_background_tasks.values():
+            task.cancel()
+        await anwer_cleanup_on_shutdown()
+
+app = FastAPI(lifespan=anwer_lifespan)
+
+# قوالب Jinja2 تُحمَّل عند أول عرض للوحة التحكم، لا عند الإقلاع
+templates = None
 
 # إنشاء مجلد للمستخدمين
 anwer_users_dir = Path("anwer_users")
@@ -38,90 +80,1559 @@ anwer_clients = {}
 anwer_sessions = {}
 anwer_monitoring_tasks = {}
 
+# المستخدمون الذين طلبوا تشغيل المراقبة (تُستأنف بعد إعادة الاتصال)، ووقت آخر تغيير لكل مستخدم
+# (يُحفظ مع الحالة ليفوز الأحدث عند دمج ملفات العمال)
+anwer_monitoring_enabled = set()
+anwer_monitoring_changed_at = {}
+
+# مهام الخلفية الدائمة: توقف أي منها يعني أن الخدمة لم تعد حية (/health)
+anwer_background_tasks = {}
+anwer_started_at = time.time()
+
+# يصبح True عند بدء الإغلاق: تتوقف معالجة الرسائل الجديدة ويُفرَّغ ما في الطوابير
+anwer_shutting_down = False
+
+# مراحل الإقلاع: لا يصبح /ready جاهزاً إلا بعد استعادة الجلسات
+anwer_readiness = {
+    "stage": "starting",
+    "sessions_total": 0,
+    "sessions_restored": 0,
+    "sessions_failed": 0,
+    "monitoring_resumed": 0
+}
+
+# نتائج فحص الاتصال لكل مستخدم
+anwer_client_health = {}
+
+# وضع العمال المتعددين (anwer_shards): رقم هذا العامل، عددهم، والعمال الأحياء حالياً
+# (العامل المُعاد تشغيله يستلم قائمة الأحياء الحالية من الواجهة الأمامية، ومعها مفتاح المسار الداخلي)
+ANWER_SHARD_INDEX = int(os.environ.get("ANWER_SHARD_INDEX", 0))
+ANWER_SHARD_COUNT = int(os.environ.get("ANWER_SHARD_COUNT", 1))
+ANWER_SHARD_TOKEN = os.environ.get("ANWER_SHARD_TOKEN", "")
+anwer_shard_alive = (
+    [int(shard_index) for shard_index in os.environ["ANWER_SHARD_ALIVE"].split(",")]
+    if os.environ.get("ANWER_SHARD_ALIVE") else list(range(ANWER_SHARD_COUNT))
+)
+
+# الإرسال التلقائي: كومة المواعيد (وقت, user_id)، الموعد الحالي لكل مستخدم، ونتائج آخر دورة
+anwer_auto_send_schedule_file = anwer_users_dir / (
+    f"anwer_schedule_{ANWER_SHARD_INDEX}.json" if ANWER_SHARD_COUNT > 1 else "anwer_schedule.json"
+)
+
+# المستخدمون الذين كانت المراقبة تعمل لديهم (تُستأنف عند الإقلاع)
+anwer_monitoring_state_file = anwer_users_dir / (
+    f"anwer_monitoring_{ANWER_SHARD_INDEX}.json" if ANWER_SHARD_COUNT > 1 else "anwer_monitoring.json"
+)
+anwer_auto_send_heap = []
+anwer_auto_send_next_run = {}
+anwer_auto_send_running = set()
+anwer_auto_send_results = {}
+anwer_auto_send_wakeup = None
+
+# مشتركو بث الأحداث للوحة التحكم: {user_id: set(asyncio.Queue)}
+anwer_event_subscribers = {}
+
+# إعدادات المستخدمين المحمّلة، ودوال تُستدعى عند تغيّرها: listener(user_id, old, new)
+anwer_settings_cache = {}
+anwer_settings_listeners = []
+
+# طوابير إرسال التنبيهات وعمالها وعداداتها لكل مستخدم (الطابور والعامل يبقيان بعد انقطاع المراقبة
+# حتى لا يضيع ما فيهما، والعامل ينتظر عودة الاتصال)
+anwer_alert_queues = {}
+anwer_dispatch_workers = {}
+anwer_dispatch_stats = {}
+anwer_rate_limiters = {}
+
+# ذاكرة معلومات المرسلين والمحادثات لكل عميل
+anwer_entity_caches = {}
+
+# نوافذ كشف التنبيهات المكررة لكل مستخدم
+anwer_dedup_windows = {}
+
+# آخر رسالة تمت معالجتها في كل محادثة لكل مستخدم (لفحص الرسائل الفائتة بعد الانقطاع)
+anwer_chat_positions = {}
+anwer_chat_positions_dirty = set()
+
+# عدادات الرسائل لكل مستخدم لنقطة /metrics (تُحدَّث من حلقة الأحداث فقط، دون أقفال)
+anwer_message_metrics = {}
+
+# محادثة التنبيهات المحلولة لكل مستخدم: {user_id: (اسم المحادثة, InputPeer)}
+anwer_notification_targets = {}
+
+# أخطاء تعني أن محادثة التنبيهات المخزنة لم تعد صالحة
+ANWER_PEER_ERRORS = (
+    ValueError, PeerIdInvalidError, ChannelPrivateError, UserIsBlockedError, InputUserDeactivatedError
+)
+
 # بيانات API الافتراضية
 DEFAULT_API_ID = 22043994
 DEFAULT_API_HASH = '56f64582b363d367280db96586b97801'
 
-async def anwer_monitor_connection_health():
-    """مراقبة صحة الاتصالات"""
-    while True:
+def anwer_load_client_factory():
+    """مصنع عملاء تيليجرام: TelegramClient، أو دالة بصيغة "module:name" في ANWER_CLIENT_FACTORY
+    (مثل anwer_fake_telegram:anwer_fake_client_factory للتشغيل دون شبكة)"""
+    factory_path = os.environ.get("ANWER_CLIENT_FACTORY")
+    if not factory_path:
+        return TelegramClient
+    module_name, _, factory_name = factory_path.partition(":")
+    return getattr(importlib.import_module(module_name), factory_name)
+
+anwer_client_factory = anwer_load_client_factory()
+
+def anwer_create_client(session_file, api_id, api_hash):
+    """إنشاء عميل تيليجرام لملف جلسة عبر المصنع الحالي"""
+    return anwer_client_factory(str(session_file), api_id, api_hash)
+
+# قاعدة بيانات التنبيهات
+anwer_alerts_db_file = anwer_users_dir / "anwer_alerts.db"
+anwer_alerts_db = None
+anwer_alerts_db_lock = threading.Lock()
+anwer_alert_write_buffer = []
+
+# مهلة انتظار قفل القاعدة بالثواني: طويلة عند التهيئة (ينتظر العامل ترحيل عامل آخر) وقصيرة بعدها
+ANWER_ALERTS_DB_MIGRATION_TIMEOUT = 600
+ANWER_ALERTS_DB_BUSY_TIMEOUT = 5
+
+# الاحتفاظ بالتنبيهات: بالعدد لكل مستخدم و/أو بالعمر بالأيام (0 = بدون حد، وهو الافتراضي لأن
+# البحث النصي يغطي التنبيهات المحفوظة فقط: الحذف يحذفها من الفهرس أيضاً)
+ANWER_ALERTS_MAX_PER_USER = int(os.environ.get("ANWER_ALERTS_MAX_PER_USER", 0))
+ANWER_ALERTS_MAX_AGE_DAYS = int(os.environ.get("ANWER_ALERTS_MAX_AGE_DAYS", 0))
+ANWER_ALERT_BATCH_SIZE = 50
+ANWER_ALERTS_PAGE_MAX = 200
+ANWER_EXPORT_CHUNK_SIZE = 500
+ANWER_ALERT_FLUSH_INTERVAL = 1.0
+
+# البحث النصي: حجم دفعة فهرسة التنبيهات القديمة، وطول المقتطف حول أول تطابق، وأقصى عدد كلمات في الاستعلام
+ANWER_SEARCH_BACKFILL_CHUNK = 5000
+ANWER_SEARCH_SNIPPET_CHARS = 160
+ANWER_SEARCH_MAX_TERMS = 16
+ANWER_SEARCH_TERM_RE = re.compile(r'\w+')
+
+# ملخصات التنبيهات (عدد لكل ساعة/يوم لكل كلمة ومجموعة ومرسل): طول بادئة الوقت لكل فترة،
+# المدى الافتراضي للعرض، وأقصى عدد فترات في الاستعلام. الملخص الساعي يُحذف بعد مدة، واليومي يبقى
+ANWER_STATS_PERIODS = {"hour": 13, "day": 10}
+ANWER_STATS_DEFAULT_SPAN = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+ANWER_STATS_MAX_BUCKETS = 1000
+ANWER_STATS_DIMENSIONS = ("keyword", "chat", "sender")
+ANWER_STATS_TOP_MAX = 50
+ANWER_ROLLUP_HOURLY_DAYS = 31
+
+# طابور إرسال التنبيهات: الحجم، مدة الانتظار قبل الإسقاط، ومعدل الإرسال (رسالة/ثانية)
+ANWER_ALERT_QUEUE_SIZE = 1000
+ANWER_ALERT_ENQUEUE_TIMEOUT = 0.5
+ANWER_NOTIFY_RATE = 1.0
+ANWER_NOTIFY_BURST = 5
+ANWER_NOTIFY_BATCH_MAX = 10
+ANWER_NOTIFY_MAX_ATTEMPTS = 3
+# فترة فحص عودة الاتصال قبل استئناف إرسال التنبيهات المعلّقة
+ANWER_DISPATCH_RECONNECT_POLL = 1.0
+
+# ذاكرة معلومات المرسلين والمحادثات: الحد الأقصى للعناصر ومدة الصلاحية بالثواني
+ANWER_ENTITY_CACHE_SIZE = 5000
+ANWER_ENTITY_CACHE_TTL = 3600
+
+# كشف التكرار: حد العناصر في النافذة لكل مستخدم، حد المجموعات المحفوظة لكل رسالة، وفترة فحص النوافذ المنتهية
+ANWER_DEDUP_MAX_ENTRIES = 2000
+ANWER_DEDUP_MAX_CHATS = 100
+ANWER_DEDUP_SWEEP_INTERVAL = 30
+
+# فحص الاتصال: الفترة بين الفحوص، عدد الفحوص المتوازية، مهلة الفحص، والتراجع عند إعادة الاتصال (بالثواني)
+ANWER_HEALTH_CHECK_INTERVAL = 300
+ANWER_HEALTH_CHECK_CONCURRENCY = 20
+ANWER_HEALTH_CHECK_TIMEOUT = 15
+ANWER_HEALTH_TICK = 5
+ANWER_RECONNECT_BASE_DELAY = 5
+ANWER_RECONNECT_MAX_DELAY = 600
+
+# بث الأحداث للوحة التحكم: حجم طابور كل مشترك، فترة رسائل الإبقاء، وعدد التنبيهات المستأنفة
+ANWER_EVENT_QUEUE_SIZE = 100
+ANWER_EVENT_KEEPALIVE = 15
+ANWER_EVENT_RESUME_LIMIT = 200
+
+# الإرسال التلقائي: أقل فترة، العشوائية المضافة، التوزيع بعد إعادة التشغيل، والفاصل بين المجموعات (بالثواني)
+ANWER_AUTO_SEND_MIN_INTERVAL = 60
+ANWER_AUTO_SEND_JITTER = 30
+ANWER_AUTO_SEND_STARTUP_SPREAD = 600
+ANWER_AUTO_SEND_GROUP_DELAY = (2, 5)
+ANWER_AUTO_SEND_MAX_FLOOD_WAIT = 300
+
+# استعادة الجلسات عند الإقلاع: عدد الاتصالات المتوازية ومهلة كل اتصال (بالثواني)
+ANWER_RESTORE_CONCURRENCY = 10
+ANWER_RESTORE_TIMEOUT = 30
+
+# عدد الرسائل الأخيرة التي تُحفظ نتيجة مطابقتها لبقية الحسابات التي تصلها نفس الرسالة
+ANWER_SHARED_RECENT_SIZE = 10000
+
+# مهلة تجميع تغييرات الخطط قبل إعادة بناء الفهرس المشترك (خارج حلقة الأحداث) بالثواني
+ANWER_SHARED_REBUILD_DELAY = 1.0
+
+# فحص الرسائل الفائتة: عدد المحادثات التي تُجلب بالتوازي لكل حساب، وفترة حفظ المواضع
+ANWER_CATCHUP_CONCURRENCY = 3
+ANWER_CATCHUP_SAVE_INTERVAL = 10
+
+# الإغلاق المنظم: المهلة الكاملة (أقل من مهلة المنصة، 30 ثانية على Heroku) والجزء المحجوز منها لقطع الاتصال
+ANWER_SHUTDOWN_TIMEOUT = float(os.environ.get("ANWER_SHUTDOWN_TIMEOUT", 20))
+ANWER_SHUTDOWN_DISCONNECT_TIMEOUT = 5
+
+# مهلة إغلاق اتصالات HTTP المفتوحة (مثل بث الأحداث) قبل بدء الإغلاق المنظم
+ANWER_HTTP_SHUTDOWN_TIMEOUT = 5
+
+# حدود المدرّجات التكرارية لزمن المطابقة (أجزاء من الملي ثانية) وزمن الإرسال والكتابة
+ANWER_MATCH_LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+ANWER_IO_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# خطط تقييم القواعد (الكلمات المراقبة والفلاتر) المُجمّعة لكل مستخدم
+anwer_rule_plans = {}
+
+# إزالة الرموز والأرقام قبل حساب بصمة الرسالة لكشف التكرار
+ANWER_DEDUP_STRIP_RE = re.compile(r'[\W\d_]+')
+
+# MinHash: عدد دوال التجزئة (ثابتة حتى تبقى البصمات قابلة للمقارنة) وعدد أجزاء LSH
+ANWER_MINHASH_PRIME = (1 << 61) - 1
+ANWER_MINHASH_PERMUTATIONS = [
+    (random.Random(seed).randrange(1, ANWER_MINHASH_PRIME), random.Random(-seed - 1).randrange(ANWER_MINHASH_PRIME))
+    for seed in range(32)
+]
+ANWER_MINHASH_BANDS = 16
+
+# تطبيع النص العربي: إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة
+ANWER_ARABIC_DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ANWER_ARABIC_CHAR_MAP = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ى': 'ي',
+    'ة': 'ه',
+})
+
+def anwer_normalize_text(text):
+    """تطبيع النص للمطابقة (حروف صغيرة + توحيد الحروف العربية)"""
+    text = ANWER_ARABIC_DIACRITICS_RE.sub('', text or '')
+    return text.translate(ANWER_ARABIC_CHAR_MAP).lower()
+
+# رموز الهروب في التعابير النمطية (\W و\S و\u0623...) تبقى كما هي عند التطبيع
+ANWER_REGEX_ESCAPE_RE = re.compile(r'(\\.)', re.DOTALL)
+
+def anwer_normalize_pattern(pattern):
+    """تطبيع الحروف في التعبير النمطي كما يُطبّع نص الرسالة، ليطابق 'أحمد' و'إدارة' النص المُطبّع"""
+    return ''.join(
+        part if part.startswith('\\') else anwer_normalize_text(part)
+        for part in ANWER_REGEX_ESCAPE_RE.split(pattern)
+    )
+
+# حدود التعابير النمطية للمستخدمين: تعمل على حلقة الأحداث المشتركة بلا مهلة، فتُرفض التعابير
+# الطويلة والمكررات المتداخلة مثل (a+)+ التي قد تستغرق وقتاً أُسّياً على رسالة واحدة
+ANWER_REGEX_MAX_LENGTH = 200
+ANWER_REGEX_REPEAT_OPS = {"MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"}
+
+def anwer_regex_has_nested_repeat(items):
+    """(هل يوجد مكرر داخل مكرر، هل يوجد مكرر بعدد غير ثابت) في تعبير محلل. العدد الثابت مثل {3}
+    والاختياري (...)? لا يُحسبان مكرراً خارجياً لأنهما لا يكرران ما بداخلهما بأكثر من طريقة"""
+    nested = variable = False
+    for op, av in items:
+        for child in anwer_regex_subpatterns(av):
+            child_nested, child_variable = anwer_regex_has_nested_repeat(child)
+            nested = nested or child_nested or (str(op) in ANWER_REGEX_REPEAT_OPS and av[1] > 1 and child_variable)
+            variable = variable or child_variable
+        if str(op) in ANWER_REGEX_REPEAT_OPS and av[0] != av[1]:
+            variable = True
+    return nested, variable
+
+def anwer_regex_subpatterns(value):
+    """التعابير الفرعية داخل وسيط عقدة (المجموعات والبدائل والمكررات)"""
+    if isinstance(value, anwer_re_parser.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from anwer_regex_subpatterns(item)
+
+def anwer_check_regex_rule(pattern):
+    """ترجمة تعبير المستخدم والتحقق من حدوده (re.error إذا كان غير صالح أو مكلفاً)"""
+    if len(pattern) > ANWER_REGEX_MAX_LENGTH:
+        raise re.error(f"أطول من {ANWER_REGEX_MAX_LENGTH} حرفاً")
+    if anwer_regex_has_nested_repeat(anwer_re_parser.parse(pattern))[0]:
+        raise re.error("مكررات متداخلة مثل (a+)+ قد تستغرق وقتاً طويلاً جداً")
+    return re.compile(pattern)
+
+def anwer_trie_pattern(words):
+    """تعبير نمطي على شكل شجرة بادئات للكلمات (أطول تطابق أولاً)"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        # السلاسل بلا تفرّع تُكتب مباشرة (دون تعاود لكل حرف في الكلمات الطويلة)
+        prefix = ''
+        while len(node) == 1 and '' not in node:
+            char, node = next(iter(node.items()))
+            prefix += re.escape(char)
+
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char != '']
+        if not branches:
+            return prefix
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # نهاية كلمة داخل الشجرة: بقية الفرع اختيارية (جشعة، فتُجرَّب الكلمة الأطول أولاً)
+        return prefix + ('(?:' + body + ')?' if '' in node else body)
+
+    return build(trie)
+
+class AnwerKeywordMatcher:
+    """مطابق مُجمّع لجميع الكلمات المراقبة في تعبير نمطي واحد"""
+
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        # كل شكل مُطبّع يقابل الكلمات الأصلية التي تنتج عنه
+        self._originals = {}
+        for keyword in self.keywords:
+            normalized = anwer_normalize_text(keyword).strip()
+            if normalized:
+                self._originals.setdefault(normalized, []).append(keyword)
+
+        # البحث الاستباقي يمر على كل موضع ويعطي أطول كلمة تبدأ عنده، فالكلمات الأقصر التي تبدأ
+        # في نفس الموضع (بادئات الكلمة الأطول) تُضاف من هنا حتى لا تضيع
+        self._order = {normalized: index for index, normalized in enumerate(self._originals)}
+        self._prefixes = {
+            normalized: [normalized[:end] for end in range(1, len(normalized) + 1) if normalized[:end] in self._order]
+            for normalized in self._originals
+        }
+
+        self._pattern = None
+        if self._originals:
+            # شجرة بادئات بدل بدائل منفصلة: زمن الفحص لا يزداد مع عدد الكلمات، ويفوز أطول تطابق
+            # عند كل موضع، والبحث الاستباقي يسمح بالتداخل
+            self._pattern = re.compile('(?=(' + anwer_trie_pattern(self._originals) + '))')
+
+    def forms(self):
+        """الأشكال المُطبّعة وما يقابلها من الكلمات الأصلية"""
+        return self._originals.items()
+
+    def match_normalized(self, normalized):
+        """إرجاع جميع الكلمات المراقبة الموجودة في نص تم تطبيعه مسبقاً"""
+        if self._pattern is None or not normalized:
+            return []
+
+        found = set()
+        for m in self._pattern.finditer(normalized):
+            matched = m.group(1)
+            if matched not in found:
+                found.update(self._prefixes[matched])
+
+        # بترتيب الكلمات في الإعدادات
+        return [keyword for normalized in sorted(found, key=self._order.__getitem__)
+                for keyword in self._originals[normalized]]
+
+class AnwerRulePlan:
+    """خطة تقييم مُجمّعة لقواعد المستخدم: فلاتر سريعة أولاً ثم فحص واحد للنص"""
+
+    def __init__(self, settings):
+        rules = settings.get("rules") or {}
+        self.key = anwer_rule_plan_key(settings)
+
+        # فلاتر سريعة لا تحتاج فحص النص
+        self.min_length = int(rules.get("min_length") or 0)
+        self.chat_allowlist = anwer_parse_id_set(rules.get("chat_allowlist"))
+        self.chat_denylist = anwer_parse_id_set(rules.get("chat_denylist"))
+        sender_blocklist = [str(s).strip() for s in rules.get("sender_blocklist") or [] if str(s).strip()]
+        self.sender_block_ids = anwer_parse_id_set(sender_blocklist)
+        self.sender_block_usernames = {s.lstrip('@').lower() for s in sender_blocklist if not s.lstrip('-').isdigit()}
+
+        # الكلمات العادية (جزء من النص)
+        self.keyword_matcher = AnwerKeywordMatcher(settings.get("keywords", []))
+
+        # الكلمات الكاملة والتعابير النمطية في تعبير واحد للفحص السريع، مع نسخة منفردة لكل قاعدة
+        self._pattern_rules = []
+        for keyword in rules.get("whole_word_keywords") or []:
+            normalized = anwer_normalize_text(keyword).strip()
+            if normalized:
+                self._pattern_rules.append((keyword, r'(?<!\w)' + re.escape(normalized) + r'(?!\w)'))
+        for pattern in rules.get("regex_rules") or []:
+            try:
+                normalized = anwer_normalize_pattern(pattern)
+                anwer_check_regex_rule(normalized)
+                self._pattern_rules.append((pattern, normalized))
+            except re.error as e:
+                logger.error(f"تعبير نمطي غير صالح '{pattern}': {e}")
+
+        self._combined = None
+        self._compiled_rules = [(label, re.compile(p, re.IGNORECASE)) for label, p in self._pattern_rules]
+        if self._pattern_rules:
+            try:
+                self._combined = re.compile('|'.join(f'(?:{p})' for _, p in self._pattern_rules), re.IGNORECASE)
+            except re.error:
+                # مثل المراجع الخلفية المرقّمة: تُفحص القواعد منفردة
+                self._combined = None
+
+        # الكلمات المستبعدة: وجود أي منها يلغي التنبيه
+        excluded = {anwer_normalize_text(k).strip() for k in rules.get("exclude_keywords") or []} - {''}
+        self._exclude = re.compile('|'.join(map(re.escape, excluded))) if excluded else None
+
+    def accepts(self, event, message_text):
+        """الفلاتر السريعة التي لا تحتاج فحص النص"""
+        if len(message_text) < self.min_length or not message_text:
+            return False
+
+        if self.chat_allowlist or self.chat_denylist:
+            chat_ids = anwer_event_chat_ids(event)
+            if self.chat_allowlist and not (chat_ids & self.chat_allowlist):
+                return False
+            if chat_ids & self.chat_denylist:
+                return False
+
+        if self.sender_block_ids and event.sender_id in self.sender_block_ids:
+            return False
+        if self.sender_block_usernames:
+            username = getattr(event.sender, 'username', None)
+            if username and username.lower() in self.sender_block_usernames:
+                return False
+        return True
+
+    def match_rules(self, normalized, found):
+        """إضافة الكلمات الكاملة والتعابير النمطية لنتيجة الكلمات العادية ثم تطبيق الاستبعاد"""
+        if self._compiled_rules and (self._combined is None or self._combined.search(normalized)):
+            # وُجد تطابق: تحديد القواعد المطابقة بدقة (يحدث فقط للرسائل المطابقة)
+            found = found + [label for label, pattern in self._compiled_rules
+                             if label not in found and pattern.search(normalized)]
+
+        if found and self._exclude is not None and self._exclude.search(normalized):
+            return []
+        return found
+
+def anwer_parse_id_set(values):
+    """تحويل قائمة معرّفات (أرقام أو نصوص) إلى مجموعة أرقام"""
+    ids = set()
+    for value in values or []:
+        value = str(value).strip()
+        if value.lstrip('-').isdigit():
+            ids.add(int(value))
+    return ids
+
+def anwer_event_chat_ids(event):
+    """معرّف المحادثة بالصيغتين: المعلّمة (-100...) والمجردة كما تُحفظ في التنبيهات"""
+    chat_id = event.chat_id
+    if chat_id is None:
+        return set()
+    return {chat_id, resolve_id(chat_id)[0]}
+
+def anwer_rule_plan_key(settings):
+    """مفتاح يتغير عند تغيّر الكلمات أو القواعد"""
+    return json.dumps([settings.get("keywords", []), settings.get("rules") or {}], sort_keys=True, ensure_ascii=False)
+
+def anwer_get_rule_plan(user_id, settings):
+    """الحصول على خطة قواعد المستخدم وإعادة بنائها فقط عند تغيّر الكلمات أو القواعد"""
+    plan = anwer_rule_plans.get(user_id)
+    if plan is None or plan.key != anwer_rule_plan_key(settings):
+        plan = AnwerRulePlan(settings)
+        anwer_rule_plans[user_id] = plan
+        anwer_shared_matcher.invalidate(user_id)
+    return plan
+
+class AnwerSharedMatcher:
+    """مطابقة مشتركة بين الحسابات: كل رسالة تُطبّع وتُفحص مرة واحدة مقابل فهرس مُدمج لكلمات
+    جميع المستخدمين، ثم يأخذ كل حساب نتيجته من الذاكرة عندما تصله نفس الرسالة"""
+
+    def __init__(self, recent_size):
+        self.recent_size = recent_size
+        self.computed = 0
+        self.reused = 0
+        self.rebuilds = 0
+        self._recent = OrderedDict()
+        self._matcher = None
+        self._users_by_form = {}
+        # الخطط التي تغيّرت بعد بناء الفهرس الحالي {user_id: الخطة أو None إن حُذفت}
+        self._pending = {}
+        self._rebuild = None
+
+    def invalidate(self, user_id):
+        """تسجيل تغيّر خطة المستخدم: يُفحص بخطته منفرداً حتى يُعاد بناء الفهرس في الخلفية"""
+        self._pending[user_id] = anwer_rule_plans.get(user_id)
+        self._recent.clear()
+
+    def evaluate(self, user_id, message, message_text):
+        """القواعد المطابقة للمستخدم (فلاتره السريعة ثم نتيجة الفحص المشترك للنص)"""
+        plan = anwer_rule_plans[user_id]
+        if not plan.accepts(message, message_text):
+            return []
+        entry = self._match(message, message_text)
+        return plan.match_rules(entry["normalized"], entry["keywords"].get(user_id, []))
+
+    def _match(self, message, message_text):
+        # أرقام الرسائل مشتركة بين الحسابات في القنوات والمجموعات الكبيرة فقط، أما المجموعات العادية فلكل حساب أرقامه
+        key = (message.chat_id, message.id) if message.is_channel else None
+        if key is not None:
+            entry = self._recent.get(key)
+            if entry is not None and entry["text"] == message_text:
+                self.reused += 1
+                return entry
+
+        if self._pending and self._rebuild is None:
+            self._rebuild = asyncio.create_task(self._rebuild_index())
+
+        normalized = anwer_normalize_text(message_text)
+        keywords = {}
+        if self._matcher is not None:
+            for form in self._matcher.match_normalized(normalized):
+                for user_id, originals in self._users_by_form[form]:
+                    if user_id not in self._pending:
+                        keywords.setdefault(user_id, []).extend(originals)
+        # المستخدمون الذين تغيّرت خططهم بعد بناء الفهرس (عددهم صغير ولفترة قصيرة)
+        for user_id, plan in self._pending.items():
+            if plan is not None:
+                found = plan.keyword_matcher.match_normalized(normalized)
+                if found:
+                    keywords[user_id] = found
+
+        entry = {"text": message_text, "normalized": normalized, "keywords": keywords}
+        self.computed += 1
+        if key is not None:
+            self._recent[key] = entry
+            if len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+        return entry
+
+    async def _rebuild_index(self):
+        """إعادة بناء الفهرس المدمج في خيط منفصل بعد تجميع التغييرات (الفهرس السابق يبقى مستخدماً)"""
         try:
-            for user_id, client in anwer_clients.items():
-                if client and client.is_connected():
-                    try:
-                        await client.get_me()
-                    except Exception as e:
-                        logger.error(f"⚠️ فقدان الاتصال للمستخدم {user_id}: {e}")
-                        if user_id in anwer_monitoring_tasks:
-                            anwer_monitoring_tasks[user_id].cancel()
-                            del anwer_monitoring_tasks[user_id]
-            await asyncio.sleep(300)  # فحص كل 5 دقائق
+            while self._pending:
+                await asyncio.sleep(ANWER_SHARED_REBUILD_DELAY)
+                plans = dict(anwer_rule_plans)
+                matcher, users_by_form = await asyncio.to_thread(self._build, plans)
+
+                self._matcher, self._users_by_form = matcher, users_by_form
+                # ما تغيّر أثناء البناء يبقى للدورة التالية
+                self._pending = {
+                    user_id: plan for user_id, plan in self._pending.items()
+                    if anwer_rule_plans.get(user_id) is not plans.get(user_id)
+                }
+                self.rebuilds += 1
         except Exception as e:
-            logger.error(f"خطأ في مراقبة الاتصال: {e}")
-            await asyncio.sleep(60)
+            logger.error(f"خطأ في بناء فهرس المطابقة المشترك: {e}")
+        finally:
+            self._rebuild = None
+
+    @staticmethod
+    def _build(plans):
+        users_by_form = {}
+        for user_id, plan in plans.items():
+            for form, originals in plan.keyword_matcher.forms():
+                users_by_form.setdefault(form, []).append((user_id, originals))
+        return AnwerKeywordMatcher(users_by_form), users_by_form
+
+anwer_shared_matcher = AnwerSharedMatcher(ANWER_SHARED_RECENT_SIZE)
+
+class AnwerDedupWindow:
+    """نافذة زمنية لكشف الرسائل المكررة والمتشابهة (MinHash) قبل إرسال التنبيه"""
+
+    def __init__(self, window_seconds, max_entries, min_similarity, enabled=True):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._entries = OrderedDict()
+        self._bands = {}
+        self._evicted = []
+
+    def configure(self, enabled, window_seconds, min_similarity):
+        """تحديث الإعدادات دون فقدان النافذة الحالية"""
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.min_similarity = min_similarity
+
+    def check(self, message_text, keywords, chat_id):
+        """True إذا كانت الرسالة جديدة ويجب إرسالها، False إذا كانت مكررة داخل النافذة"""
+        normalized = ' '.join(ANWER_DEDUP_STRIP_RE.sub(' ', anwer_normalize_text(message_text)).split())
+        if not normalized:
+            return True
+
+        now = time.monotonic()
+        key = hashlib.blake2b(normalized.encode(), digest_size=8).digest()
+        entry = self._entries.get(key)
+        signature = None
+        if entry is None and self.min_similarity < 1:
+            signature = anwer_minhash(normalized)
+            entry = self._find_near_duplicate(signature)
+
+        if entry is not None and entry["expires"] > now:
+            entry["suppressed"] += 1
+            if len(entry["chat_ids"]) < ANWER_DEDUP_MAX_CHATS:
+                entry["chat_ids"].add(chat_id)
+            return False
+
+        if signature is None:
+            signature = anwer_minhash(normalized)
+        self._add(key, {
+            "key": key,
+            "expires": now + self.window_seconds,
+            "signature": signature,
+            "keywords": keywords,
+            "message_text": message_text,
+            "first_chat_id": chat_id,
+            "chat_ids": set(),
+            "suppressed": 0
+        })
+        return True
 
-def anwer_load_user_settings(user_id):
-    """تحميل إعدادات المستخدم"""
-    settings_file = anwer_users_dir / f"anwer_settings_{user_id}.json"
-    if settings_file.exists():
+    def pop_expired(self, everything=False):
+        """إزالة العناصر المنتهية (أو كلها عند الإغلاق) وإرجاع التي تكررت لإرسال تنبيه مُجمّع عنها"""
+        now = time.monotonic()
+        summaries, self._evicted = self._evicted, []
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry["expires"] > now and not everything:
+                break
+            self._remove(entry)
+            if entry["suppressed"]:
+                summaries.append(entry)
+        return summaries
+
+    def _find_near_duplicate(self, signature):
+        checked = set()
+        for band_key in anwer_minhash_bands(signature):
+            for key in self._bands.get(band_key, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                entry = self._entries[key]
+                same = sum(a == b for a, b in zip(entry["signature"], signature))
+                if same / len(signature) >= self.min_similarity:
+                    return entry
+        return None
+
+    def _add(self, key, entry):
+        if key in self._entries:
+            self._remove(self._entries[key])
+        self._entries[key] = entry
+        for band_key in anwer_minhash_bands(entry["signature"]):
+            self._bands.setdefault(band_key, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries.values()))
+            self._remove(oldest)
+            if oldest["suppressed"]:
+                self._evicted.append(oldest)
+
+    def _remove(self, entry):
+        self._entries.pop(entry["key"], None)
+        for band_key in anwer_minhash_bands(entry["signature"]):
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(entry["key"])
+                if not keys:
+                    del self._bands[band_key]
+
+def anwer_minhash(normalized):
+    """بصمة MinHash لمقاطع النص (4 حروف) لتقدير التشابه بين رسالتين"""
+    shingles = {normalized[i:i + 4] for i in range(max(len(normalized) - 3, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+    return tuple(
+        min((a * h + b) % ANWER_MINHASH_PRIME for h in hashes)
+        for a, b in ANWER_MINHASH_PERMUTATIONS
+    )
+
+def anwer_minhash_bands(signature):
+    """تقسيم البصمة لأجزاء (LSH): الرسائل المتشابهة تشترك غالباً في جزء واحد على الأقل"""
+    rows = len(signature) // ANWER_MINHASH_BANDS
+    return [(band, signature[band * rows:(band + 1) * rows]) for band in range(ANWER_MINHASH_BANDS)]
+
+class AnwerMessageMetrics:
+    """عدادات الرسائل المستلمة والمطابقة لمستخدم واحد"""
+    __slots__ = ("seen", "matched")
+
+    def __init__(self):
+        self.seen = 0
+        self.matched = 0
+
+class AnwerDispatchStats:
+    """عدادات طابور التنبيهات لمستخدم واحد"""
+    __slots__ = (
+        "enqueued", "sent", "batched", "dropped", "failed", "suppressed",
+        "caught_up", "catch_up_truncated", "flood_waits", "flood_wait_seconds"
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        """العدادات كقاموس (لحالة المستخدم)"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class AnwerHistogram:
+    """مدرّج تكراري بحدود ثابتة بصيغة Prometheus (التسجيل لا يحجز ذاكرة ولا يستخدم أقفالاً)"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """تسجيل قيمة (بالثواني)"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """القيم التراكمية لكل حد: [(le, count)]"""
+        cumulative = 0
+        result = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+anwer_match_latency = AnwerHistogram(ANWER_MATCH_LATENCY_BUCKETS)
+anwer_notification_latency = AnwerHistogram(ANWER_IO_LATENCY_BUCKETS)
+anwer_alert_write_latency = AnwerHistogram(ANWER_IO_LATENCY_BUCKETS)
+
+class AnwerTokenBucket:
+    """محدد معدل (دلو رموز) يدعم الإيقاف المؤقت عند FloodWait"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """إيقاف الإرسال حتى انتهاء مدة الانتظار وتفريغ الرصيد"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        """انتظار توفر رمز للإرسال"""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self.tokens = min(self.capacity, self.tokens + (now - max(self.updated_at, self.paused_until)) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AnwerEntityCache:
+    """ذاكرة LRU بمدة صلاحية لمعلومات المرسلين والمحادثات"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """إرجاع القيمة المخزنة أو None إذا لم توجد أو انتهت صلاحيتها"""
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        """تخزين قيمة وحذف الأقدم استخداماً عند تجاوز الحد"""
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        """حذف عنصر من الذاكرة"""
+        self._items.pop(key, None)
+
+    def stats(self):
+        """إحصائيات الذاكرة"""
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+def anwer_get_client_health(user_id):
+    """حالة فحص الاتصال للمستخدم"""
+    return anwer_client_health.setdefault(user_id, {
+        "ok": None,
+        "last_check": None,
+        "latency_ms": None,
+        "failures": 0,
+        "next_check": 0.0,
+        "error": None
+    })
+
+def anwer_reconnect_delay(failures):
+    """مدة الانتظار قبل إعادة المحاولة: تراجع أُسّي مع عشوائية"""
+    delay = min(ANWER_RECONNECT_MAX_DELAY, ANWER_RECONNECT_BASE_DELAY * 2 ** max(failures - 1, 0))
+    return delay * random.uniform(0.5, 1.5)
+
+async def anwer_reconnect_client(user_id, client):
+    """إعادة اتصال العميل وإعادة تشغيل المراقبة إذا كانت مفعّلة"""
+    try:
+        await client.disconnect()
+    except Exception:
+        pass
+
+    await asyncio.wait_for(client.connect(), timeout=ANWER_HEALTH_CHECK_TIMEOUT)
+    if not await client.is_user_authorized():
+        # لا فائدة من استئناف المراقبة قبل تسجيل الدخول من جديد
+        anwer_set_monitoring_enabled(user_id, False)
+        raise PermissionError("الجلسة غير مصرح بها")
+
+    logger.info(f"🔄 تمت إعادة الاتصال للمستخدم {user_id}")
+    if user_id in anwer_monitoring_enabled:
+        anwer_start_monitoring_task(user_id)
+
+async def anwer_check_client_health(user_id, client, semaphore):
+    """فحص اتصال عميل واحد ضمن حد التوازي"""
+    health = anwer_get_client_health(user_id)
+    async with semaphore:
+        started_at = time.monotonic()
         try:
-            with open(settings_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            if not client.is_connected():
+                raise ConnectionError("العميل غير متصل")
+            await asyncio.wait_for(client.get_me(), timeout=ANWER_HEALTH_CHECK_TIMEOUT)
+            health.update({"ok": True, "failures": 0, "error": None})
+        except AuthKeyUnregisteredError as e:
+            # الجلسة أُلغيت من تليجرام: لا فائدة من إعادة الاتصال
+            logger.error(f"⚠️ الجلسة غير صالحة للمستخدم {user_id}: {e}")
+            anwer_set_monitoring_enabled(user_id, False)
+            health.update({"ok": False, "error": str(e)})
         except Exception as e:
-            logger.error(f"خطأ في تحميل الإعدادات: {e}")
+            error = str(e) or type(e).__name__
+            logger.error(f"⚠️ فقدان الاتصال للمستخدم {user_id}: {error}")
+            health.update({"ok": False, "error": error})
+            try:
+                await anwer_reconnect_client(user_id, client)
+                health.update({"ok": True, "failures": 0, "error": None})
+            except Exception as reconnect_error:
+                logger.error(f"فشل إعادة الاتصال للمستخدم {user_id}: {reconnect_error}")
+        finally:
+            health["last_check"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            health["latency_ms"] = round((time.monotonic() - started_at) * 1000, 1)
+
+    anwer_publish_status(user_id)
+    if health["ok"]:
+        health["next_check"] = time.monotonic() + ANWER_HEALTH_CHECK_INTERVAL
+    else:
+        health["failures"] += 1
+        health["next_check"] = time.monotonic() + anwer_reconnect_delay(health["failures"])
+
+async def anwer_health_supervisor():
+    """مراقبة صحة الاتصالات لجميع العملاء بالتوازي"""
+    semaphore = asyncio.Semaphore(ANWER_HEALTH_CHECK_CONCURRENCY)
+    while True:
+        try:
+            now = time.monotonic()
+            due = [
+                (user_id, client) for user_id, client in list(anwer_clients.items())
+                if client and anwer_get_client_health(user_id)["next_check"] <= now
+            ]
+            if due:
+                await asyncio.gather(*(
+                    anwer_check_client_health(user_id, client, semaphore) for user_id, client in due
+                ))
+        except Exception as e:
+            logger.error(f"خطأ في مراقبة الاتصال: {e}")
+        await asyncio.sleep(ANWER_HEALTH_TICK)
 
+def anwer_default_user_settings():
+    """الإعدادات الافتراضية للمستخدم الجديد"""
     return {
         "api_id": DEFAULT_API_ID,
         "api_hash": DEFAULT_API_HASH,
         "phone": "",
         "keywords": ["حل واجب", "انجاز", "assignment", "homework"],
         "notifications_chat": "التنبيهات",
+        "rules": {
+            "exclude_keywords": [],
+            "whole_word_keywords": [],
+            "regex_rules": [],
+            "chat_allowlist": [],
+            "chat_denylist": [],
+            "sender_blocklist": [],
+            "min_length": 0
+        },
+        "dedup": {
+            "enabled": True,
+            "window_seconds": 600,
+            "min_similarity": 0.7
+        },
+        "catch_up": {
+            "enabled": True,
+            "max_gap": 500
+        },
         "auto_send_enabled": False,
         "auto_send_interval": 3600,
         "auto_send_groups": [],
         "message": ""
     }
 
+def anwer_load_user_settings(user_id):
+    """تحميل إعدادات المستخدم (من الذاكرة إن وُجدت)"""
+    if user_id not in anwer_settings_cache:
+        settings = None
+        settings_file = anwer_users_dir / f"anwer_settings_{user_id}.json"
+        if settings_file.exists():
+            try:
+                with open(settings_file, 'r', encoding='utf-8') as f:
+                    settings = json.load(f)
+            except Exception as e:
+                logger.error(f"خطأ في تحميل الإعدادات: {e}")
+
+        if settings is None:
+            # لا تُخزَّن الإعدادات الافتراضية حتى يُعاد قراءة الملف بعد إنشائه
+            return anwer_default_user_settings()
+        anwer_settings_cache[user_id] = settings
+
+    return copy.deepcopy(anwer_settings_cache[user_id])
+
 def anwer_save_user_settings(user_id, settings):
-    """حفظ إعدادات المستخدم"""
+    """حفظ إعدادات المستخدم (كتابة ذرية + تحديث الذاكرة)"""
     settings_file = anwer_users_dir / f"anwer_settings_{user_id}.json"
+    temp_file = settings_file.with_name(f"{settings_file.name}.{os.getpid()}.tmp")
     try:
-        with open(settings_file, 'w', encoding='utf-8') as f:
+        with open(temp_file, 'w', encoding='utf-8') as f:
             json.dump(settings, f, ensure_ascii=False, indent=2)
-        return True
+        os.replace(temp_file, settings_file)
     except Exception as e:
         logger.error(f"خطأ في حفظ الإعدادات: {e}")
+        temp_file.unlink(missing_ok=True)
         return False
 
-def anwer_load_user_alerts(user_id):
-    """تحميل تنبيهات المستخدم"""
-    alerts_file = anwer_users_dir / f"anwer_alerts_{user_id}.json"
-    if alerts_file.exists():
+    old_settings = anwer_settings_cache.get(user_id) or anwer_default_user_settings()
+    anwer_settings_cache[user_id] = copy.deepcopy(settings)
+
+    for listener in anwer_settings_listeners:
         try:
-            with open(alerts_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            listener(user_id, old_settings, anwer_settings_cache[user_id])
         except Exception as e:
-            logger.error(f"خطأ في تحميل التنبيهات: {e}")
-    return []
+            logger.error(f"خطأ في تطبيق تغيير الإعدادات: {e}")
+    return True
 
-def anwer_save_alert(user_id, alert):
-    """حفظ تنبيه جديد"""
-    alerts = anwer_load_user_alerts(user_id)
-    alerts.append(alert)
+def anwer_on_settings_changed(user_id, old_settings, new_settings):
+    """تطبيق الإعدادات الجديدة على المراقبة الجارية دون إعادة تشغيلها"""
+    if old_settings.get("notifications_chat") != new_settings.get("notifications_chat"):
+        anwer_notification_targets.pop(user_id, None)
 
-    # الاحتفاظ بآخر 1000 تنبيه فقط
-    if len(alerts) > 1000:
-        alerts = alerts[-1000:]
+    if user_id in anwer_rule_plans:
+        anwer_get_rule_plan(user_id, new_settings)
 
-    alerts_file = anwer_users_dir / f"anwer_alerts_{user_id}.json"
+    if user_id in anwer_dedup_windows:
+        dedup = new_settings.get("dedup") or {}
+        anwer_dedup_windows[user_id].configure(
+            dedup.get("enabled", True), dedup.get("window_seconds", 600), dedup.get("min_similarity", 0.7)
+        )
+
+anwer_settings_listeners.append(anwer_on_settings_changed)
+
+ANWER_ALERT_COLUMNS = (
+    "timestamp", "keyword", "keywords", "message", "sender_name", "sender_username",
+    "chat_title", "chat_link", "chat_link_type", "chat_id", "sender_id"
+)
+
+# أعمدة أُضيفت بعد الإصدار الأول من الجدول (تُضاف للقواعد القديمة عند التهيئة)
+ANWER_ALERT_ADDED_COLUMNS = {"sender_id": "INTEGER"}
+
+ANWER_ALERTS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        keyword TEXT,
+        keywords TEXT,
+        message TEXT,
+        sender_name TEXT,
+        sender_username TEXT,
+        chat_title TEXT,
+        chat_link TEXT,
+        chat_link_type TEXT,
+        chat_id INTEGER,
+        sender_id INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_user_timestamp ON alerts (user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_user_id ON alerts (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_keyword ON alerts (keyword)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_chat_id ON alerts (chat_id)",
+    # التصفية بالمرسل بتكلفة الصفحة لا السجل: بمعرّفه، أو باسم المستخدم للتنبيهات الأقدم منه
+    "CREATE INDEX IF NOT EXISTS idx_alerts_user_sender ON alerts (user_id, sender_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_user_sender_username ON alerts (user_id, sender_username, id)",
+    # فهرس البحث النصي: يحفظ النص بعد التطبيع العربي (rowid = رقم التنبيه)
+    """CREATE VIRTUAL TABLE IF NOT EXISTS alerts_fts USING fts5 (
+        message, keywords, sender, chat_title, user_id,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS alerts_fts_delete AFTER DELETE ON alerts BEGIN
+        DELETE FROM alerts_fts WHERE rowid = old.id;
+    END""",
+)
+
+# كلمات كل تنبيه في جدول مستقل مرتب بالمستخدم والكلمة، لتصفية التنبيهات بالكلمة دون فحص السجل كاملاً
+ANWER_ALERT_KEYWORDS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS alert_keywords (
+        user_id TEXT NOT NULL,
+        keyword TEXT NOT NULL,
+        alert_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, keyword, alert_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_alert_keywords_alert ON alert_keywords (alert_id)",
+    """CREATE TRIGGER IF NOT EXISTS alert_keywords_delete AFTER DELETE ON alerts BEGIN
+        DELETE FROM alert_keywords WHERE alert_id = old.id;
+    END""",
+)
+
+ANWER_ROLLUPS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alert_rollups (
+        user_id TEXT NOT NULL,
+        period TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        value TEXT NOT NULL,
+        label TEXT,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, period, dimension, bucket, value)
+    ) WITHOUT ROWID
+"""
+
+def anwer_init_alerts_db():
+    """فتح قاعدة بيانات التنبيهات وإنشاء الجداول وترحيل ملفات JSON القديمة"""
+    global anwer_alerts_db
+    with anwer_alerts_db_lock:
+        if anwer_alerts_db is not None:
+            return anwer_alerts_db
+
+        db = sqlite3.connect(str(anwer_alerts_db_file), check_same_thread=False, timeout=ANWER_ALERTS_DB_MIGRATION_TIMEOUT)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+
+        # الإنشاء والترحيل في معاملة واحدة بقفل كتابة: العمال (anwer_shards) يفتحون القاعدة نفسها معاً،
+        # فينتظر كل عامل من سبقه ثم يتحقق مما بقي (الفهرسة والملخصات والملفات) قبل تنفيذه
+        renamed = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(ANWER_ALERTS_SCHEMA[0])
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(alerts)")}
+            for column, column_type in ANWER_ALERT_ADDED_COLUMNS.items():
+                if column not in columns:
+                    db.execute(f"ALTER TABLE alerts ADD COLUMN {column} {column_type}")
+            for statement in ANWER_ALERTS_SCHEMA[1:]:
+                db.execute(statement)
+            anwer_backfill_search_index(db)
+
+            # الملخصات لا تُحذف مع التنبيهات (سجل الاتجاهات أطول من سجل التنبيهات)
+            rollups_exist = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'alert_rollups'").fetchone()
+            db.execute(ANWER_ROLLUPS_SCHEMA)
+            if not rollups_exist:
+                anwer_backfill_rollups(db)
+
+            keywords_exist = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'alert_keywords'").fetchone()
+            for statement in ANWER_ALERT_KEYWORDS_SCHEMA:
+                db.execute(statement)
+            if not keywords_exist:
+                anwer_backfill_alert_keywords(db)
+
+            anwer_migrate_json_alerts(db, renamed)
+            db.commit()
+        except Exception:
+            db.rollback()
+            for migrated_file, alerts_file in renamed:
+                migrated_file.rename(alerts_file)
+            db.close()
+            raise
+
+        db.execute(f"PRAGMA busy_timeout = {ANWER_ALERTS_DB_BUSY_TIMEOUT * 1000}")
+        anwer_alerts_db = db
+    return anwer_alerts_db
+
+def anwer_search_user_token(user_id):
+    """رمز واحد يمثل المستخدم في الفهرس (المعرّف الأصلي يتقطّع عند الشرطات فيطول التقاطع)"""
+    return "u" + hashlib.sha1(user_id.encode()).hexdigest()[:16]
+
+def anwer_search_row(alert_id, row):
+    """تحويل صف التنبيه إلى صف في فهرس البحث (نص مُطبّع)"""
+    alert = dict(zip(("user_id",) + ANWER_ALERT_COLUMNS, row))
     try:
-        with open(alerts_file, 'w', encoding='utf-8') as f:
-            json.dump(alerts, f, ensure_ascii=False, indent=2)
+        keywords = json.loads(alert["keywords"] or "[]")
+    except ValueError:
+        keywords = [alert["keyword"]]
+    return (
+        alert_id,
+        anwer_normalize_text(alert["message"]),
+        anwer_normalize_text(" ".join(filter(None, keywords or [alert["keyword"]]))),
+        anwer_normalize_text(f"{alert['sender_name'] or ''} {alert['sender_username'] or ''}"),
+        anwer_normalize_text(alert["chat_title"]),
+        anwer_search_user_token(alert["user_id"]),
+    )
+
+def anwer_index_alerts(db, inserted):
+    """إضافة التنبيهات المحفوظة إلى فهرس البحث (ضمن معاملة الحفظ نفسها)"""
+    db.executemany(
+        "INSERT INTO alerts_fts (rowid, message, keywords, sender, chat_title, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [anwer_search_row(alert_id, row) for alert_id, row in inserted]
+    )
+
+def anwer_backfill_search_index(db):
+    """فهرسة التنبيهات المحفوظة قبل إضافة البحث (أو بعد انقطاع) على دفعات (ضمن معاملة التهيئة)"""
+    indexed = 0
+    while True:
+        last_id = db.execute("SELECT COALESCE(MAX(rowid), 0) FROM alerts_fts").fetchone()[0]
+        rows = db.execute(
+            f"SELECT id, user_id, {', '.join(ANWER_ALERT_COLUMNS)} FROM alerts WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, ANWER_SEARCH_BACKFILL_CHUNK)
+        ).fetchall()
+        if not rows:
+            break
+        anwer_index_alerts(db, [(row[0], tuple(row)[1:]) for row in rows])
+        indexed += len(rows)
+
+    if indexed:
+        logger.info(f"🔎 تمت فهرسة {indexed} تنبيه للبحث")
+
+def anwer_index_alert_keywords(db, inserted):
+    """إضافة كلمات التنبيهات المحفوظة لجدول التصفية بالكلمة (ضمن معاملة الحفظ نفسها)"""
+    entries = []
+    for alert_id, row in inserted:
+        alert = dict(zip(("user_id",) + ANWER_ALERT_COLUMNS, row))
+        try:
+            keywords = json.loads(alert["keywords"] or "[]")
+        except ValueError:
+            keywords = [alert["keyword"]]
+        entries.extend((alert["user_id"], keyword, alert_id) for keyword in keywords or [alert["keyword"]] if keyword)
+    db.executemany("INSERT OR IGNORE INTO alert_keywords (user_id, keyword, alert_id) VALUES (?, ?, ?)", entries)
+
+def anwer_backfill_alert_keywords(db):
+    """بناء جدول الكلمات من التنبيهات المحفوظة قبل إضافته (مرة واحدة، ضمن معاملة التهيئة)"""
+    last_id, total = 0, 0
+    while True:
+        rows = db.execute(
+            f"SELECT id, user_id, {', '.join(ANWER_ALERT_COLUMNS)} FROM alerts WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, ANWER_SEARCH_BACKFILL_CHUNK)
+        ).fetchall()
+        if not rows:
+            break
+        anwer_index_alert_keywords(db, [(row[0], tuple(row)[1:]) for row in rows])
+        last_id = rows[-1][0]
+        total += len(rows)
+
+    if total:
+        logger.info(f"🏷️ تمت فهرسة كلمات {total} تنبيه")
+
+def anwer_alert_row(user_id, alert):
+    """تحويل التنبيه إلى صف في قاعدة البيانات"""
+    row = [user_id]
+    for column in ANWER_ALERT_COLUMNS:
+        value = alert.get(column)
+        if column == "keywords":
+            value = json.dumps(value if value is not None else [alert.get("keyword", "")], ensure_ascii=False)
+        row.append(value)
+    return row
+
+def anwer_alert_from_row(row):
+    """تحويل صف قاعدة البيانات إلى قاموس تنبيه"""
+    alert = dict(row)
+    alert.pop("user_id", None)
+    try:
+        alert["keywords"] = json.loads(alert.get("keywords") or "[]")
+    except ValueError:
+        alert["keywords"] = [alert.get("keyword", "")]
+    return alert
+
+def anwer_rollup_sender(alert):
+    """مفتاح المرسل في الملخصات: معرّفه، وللتنبيهات الأقدم منه اسم المستخدم الفعلي ثم الاسم
+    (من لا يملك اسم مستخدم يُحفظ له '@' أو '@غير متوفر'، فلا يصلح مفتاحاً)"""
+    if alert.get("sender_id") is not None:
+        return str(alert["sender_id"])
+    username = (alert["sender_username"] or "").lstrip("@")
+    if username and username != "غير متوفر":
+        return f"@{username}"
+    return alert["sender_name"] or ""
+
+def anwer_rollup_counts(rows):
+    """تجميع دفعة من صفوف التنبيهات إلى عدّادات الملخص {(المستخدم، الفترة، البُعد، الفترة الزمنية، القيمة): [الاسم، العدد]}"""
+    counts = {}
+    for row in rows:
+        alert = dict(zip(("user_id",) + ANWER_ALERT_COLUMNS, row))
+        try:
+            keywords = json.loads(alert["keywords"] or "[]")
+        except ValueError:
+            keywords = [alert["keyword"]]
+
+        chat_id = alert["chat_id"]
+        sender = anwer_rollup_sender(alert)
+        entries = [
+            ("total", "", None),
+            ("chat", str(chat_id) if chat_id is not None else alert["chat_title"] or "", alert["chat_title"]),
+            ("sender", sender, alert["sender_name"] or sender),
+        ]
+        entries.extend(("keyword", keyword, keyword) for keyword in dict.fromkeys(keywords or [alert["keyword"]]) if keyword)
+
+        for period, length in ANWER_STATS_PERIODS.items():
+            bucket = (alert["timestamp"] or "")[:length]
+            for dimension, value, label in entries:
+                entry = counts.setdefault((alert["user_id"], period, dimension, bucket, value), [label, 0])
+                entry[0] = label
+                entry[1] += 1
+    return counts
+
+def anwer_apply_rollups(db, rows):
+    """إضافة دفعة التنبيهات إلى الملخصات (ضمن معاملة الحفظ نفسها)"""
+    db.executemany(
+        """INSERT INTO alert_rollups (user_id, period, dimension, bucket, value, label, count)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, period, dimension, bucket, value)
+           DO UPDATE SET count = count + excluded.count, label = excluded.label""",
+        [(*key, label, count) for key, (label, count) in anwer_rollup_counts(rows).items()]
+    )
+
+def anwer_backfill_rollups(db):
+    """بناء الملخصات من التنبيهات المحفوظة قبل إضافتها (مرة واحدة، ضمن معاملة التهيئة)"""
+    last_id, total = 0, 0
+    while True:
+        rows = db.execute(
+            f"SELECT id, user_id, {', '.join(ANWER_ALERT_COLUMNS)} FROM alerts WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, ANWER_SEARCH_BACKFILL_CHUNK)
+        ).fetchall()
+        if not rows:
+            break
+        anwer_apply_rollups(db, [tuple(row)[1:] for row in rows])
+        last_id = rows[-1][0]
+        total += len(rows)
+
+    if total:
+        logger.info(f"📊 تم بناء ملخصات {total} تنبيه")
+
+def anwer_migrate_json_alerts(db, renamed):
+    """ترحيل ملفات التنبيهات القديمة (JSON) إلى قاعدة البيانات مرة واحدة (ضمن معاملة التهيئة)"""
+    # الملف يُعاد تسميته قبل إتمام المعاملة حتى لا يرحّله عامل آخر ينتظر القفل؛ وتُلغى التسمية إن فشلت
+    for alerts_file in anwer_users_dir.glob("anwer_alerts_*.json"):
+        user_id = alerts_file.stem[len("anwer_alerts_"):]
+        db.execute("SAVEPOINT anwer_migrate")
+        try:
+            with open(alerts_file, 'r', encoding='utf-8') as f:
+                alerts = json.load(f)
+
+            inserted = []
+            for alert in alerts:
+                row = anwer_alert_row(user_id, alert)
+                cursor = db.execute(
+                    f"INSERT INTO alerts (user_id, {', '.join(ANWER_ALERT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(ANWER_ALERT_COLUMNS) + 1))})",
+                    row
+                )
+                inserted.append((cursor.lastrowid, row))
+            anwer_index_alerts(db, inserted)
+            anwer_index_alert_keywords(db, inserted)
+            anwer_apply_rollups(db, [row for _, row in inserted])
+
+            migrated_file = alerts_file.rename(alerts_file.with_suffix(".json.migrated"))
+            renamed.append((migrated_file, alerts_file))
+            db.execute("RELEASE anwer_migrate")
+            logger.info(f"✅ تم ترحيل {len(alerts)} تنبيه للمستخدم {user_id}")
+        except Exception as e:
+            db.execute("ROLLBACK TO anwer_migrate")
+            db.execute("RELEASE anwer_migrate")
+            logger.error(f"خطأ في ترحيل تنبيهات {alerts_file.name}: {e}")
+
+def anwer_apply_alert_retention(user_ids):
+    """حذف التنبيهات الزائدة عن حد العدد أو العمر"""
+    cutoff = (datetime.now() - timedelta(days=ANWER_ALERTS_MAX_AGE_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    for user_id in user_ids:
+        if ANWER_ALERTS_MAX_AGE_DAYS > 0:
+            anwer_alerts_db.execute("DELETE FROM alerts WHERE user_id = ? AND timestamp < ?", (user_id, cutoff))
+
+        if ANWER_ALERTS_MAX_PER_USER > 0:
+            anwer_alerts_db.execute(
+                """DELETE FROM alerts WHERE user_id = ? AND id <= (
+                       SELECT id FROM alerts WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                   )""",
+                (user_id, user_id, ANWER_ALERTS_MAX_PER_USER)
+            )
+
+        if ANWER_ROLLUP_HOURLY_DAYS > 0:
+            hourly_cutoff = (datetime.now() - timedelta(days=ANWER_ROLLUP_HOURLY_DAYS)).strftime('%Y-%m-%d %H')
+            anwer_alerts_db.execute(
+                f"DELETE FROM alert_rollups WHERE user_id = ? AND period = 'hour' "
+                f"AND dimension IN ('total', {', '.join('?' * len(ANWER_STATS_DIMENSIONS))}) AND bucket < ?",
+                (user_id, *ANWER_STATS_DIMENSIONS, hourly_cutoff)
+            )
+
+def anwer_flush_alerts():
+    """كتابة التنبيهات المؤجلة دفعة واحدة"""
+    if not anwer_alert_write_buffer:
         return True
+
+    db = anwer_init_alerts_db()
+    rows = anwer_alert_write_buffer[:]
+    del anwer_alert_write_buffer[:]
+
+    try:
+        inserted = []
+        started_at = time.perf_counter()
+        with anwer_alerts_db_lock, db:
+            for row in rows:
+                cursor = db.execute(
+                    f"INSERT INTO alerts (user_id, {', '.join(ANWER_ALERT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(ANWER_ALERT_COLUMNS) + 1))})",
+                    row
+                )
+                inserted.append((cursor.lastrowid, row))
+            anwer_index_alerts(db, inserted)
+            anwer_index_alert_keywords(db, inserted)
+            anwer_apply_rollups(db, rows)
+            anwer_apply_alert_retention({row[0] for row in rows})
+        anwer_alert_write_latency.observe(time.perf_counter() - started_at)
     except Exception as e:
-        logger.error(f"خطأ في حفظ التنبيه: {e}")
+        # أُلغيت المعاملة كاملة: إعادة الدفعة لمقدمة الذاكرة المؤقتة لتُكتب في المحاولة التالية
+        anwer_alert_write_buffer[:0] = rows
+        logger.error(f"خطأ في حفظ التنبيهات: {e}")
         return False
 
+    # بث التنبيهات الجديدة للوحات التحكم المفتوحة
+    for alert_id, row in inserted:
+        if anwer_event_subscribers.get(row[0]):
+            alert = anwer_alert_from_row({"id": alert_id, **dict(zip(("user_id",) + ANWER_ALERT_COLUMNS, row))})
+            anwer_publish_event(row[0], "alert", alert, event_id=alert_id)
+    return True
+
+def anwer_publish_event(user_id, event_type, data, event_id=None):
+    """إرسال حدث لجميع لوحات التحكم المشتركة للمستخدم"""
+    for queue in list(anwer_event_subscribers.get(user_id, ())):
+        try:
+            queue.put_nowait((event_type, data, event_id))
+        except asyncio.QueueFull:
+            # المشترك متأخر: فصله ليعيد الاتصال ويستأنف من آخر تنبيه استلمه
+            anwer_event_subscribers[user_id].discard(queue)
+
+def anwer_user_status(user_id):
+    """حالة الاتصال والمراقبة للمستخدم"""
+    connection_status = "غير متصل"
+    monitoring_status = "متوقف"
+
+    if user_id in anwer_clients and anwer_clients[user_id]:
+        if anwer_clients[user_id].is_connected():
+            connection_status = "متصل"
+
+    if user_id in anwer_monitoring_tasks and not anwer_monitoring_tasks[user_id].done():
+        monitoring_status = "يعمل"
+
+    return {"connection_status": connection_status, "monitoring_status": monitoring_status}
+
+def anwer_publish_status(user_id):
+    """بث حالة المستخدم الحالية للوحات التحكم"""
+    if anwer_event_subscribers.get(user_id):
+        anwer_publish_event(user_id, "status", anwer_user_status(user_id))
+
+async def anwer_alert_flush_loop():
+    """كتابة التنبيهات المؤجلة بشكل دوري"""
+    while True:
+        await asyncio.sleep(ANWER_ALERT_FLUSH_INTERVAL)
+        anwer_flush_alerts()
+
+def anwer_query_alerts(sql, params=()):
+    """تنفيذ استعلام قراءة على قاعدة التنبيهات بعد كتابة المؤجل منها"""
+    anwer_flush_alerts()
+    db = anwer_init_alerts_db()
+    with anwer_alerts_db_lock:
+        return db.execute(sql, params).fetchall()
+
+def anwer_load_user_alerts(user_id):
+    """تحميل تنبيهات المستخدم"""
+    try:
+        rows = anwer_query_alerts("SELECT * FROM alerts WHERE user_id = ? ORDER BY id", (user_id,))
+        return [anwer_alert_from_row(row) for row in rows]
+    except Exception as e:
+        logger.error(f"خطأ في تحميل التنبيهات: {e}")
+    return []
+
+def anwer_normalize_timestamp(value):
+    """توحيد صيغة الوقت المُدخل مع صيغة التخزين (YYYY-MM-DD HH:MM:SS)"""
+    return value.strip().replace('T', ' ') if value else None
+
+def anwer_query_user_alerts(user_id, limit=50, cursor=None, keyword=None, chat_id=None,
+                            sender=None, since=None, until=None):
+    """صفحة من تنبيهات المستخدم من الأحدث للأقدم، مع مؤشر الصفحة التالية"""
+    source, id_column = "alerts", "alerts.id"
+    conditions = ["alerts.user_id = ?"]
+    params = [user_id]
+
+    if keyword:
+        # التصفية بالكلمة تبدأ من جدول الكلمات (مرتب بالرقم) بدل فحص كلمات كل التنبيهات
+        source = "alert_keywords JOIN alerts ON alerts.id = alert_keywords.alert_id"
+        id_column = "alert_keywords.alert_id"
+        conditions = ["alert_keywords.user_id = ?", "alert_keywords.keyword = ?"]
+        params.append(keyword)
+    if cursor is not None:
+        conditions.append(f"{id_column} < ?")
+        params.append(int(cursor))
+    if chat_id is not None:
+        conditions.append("alerts.chat_id = ?")
+        params.append(chat_id)
+    if sender:
+        # معرّف المرسل (كما في قيم المرسلين في الإحصائيات) أو @اسم المستخدم
+        if sender.lstrip('-').isdigit():
+            conditions.append("alerts.sender_id = ?")
+            params.append(int(sender))
+        else:
+            conditions.append("alerts.sender_username = ?")
+            params.append(f"@{sender.lstrip('@')}")
+    if since:
+        conditions.append("alerts.timestamp >= ?")
+        params.append(anwer_normalize_timestamp(since))
+    if until:
+        conditions.append("alerts.timestamp <= ?")
+        params.append(anwer_normalize_timestamp(until))
+
+    rows = anwer_query_alerts(
+        f"SELECT alerts.* FROM {source} WHERE {' AND '.join(conditions)} ORDER BY {id_column} DESC LIMIT ?",
+        (*params, limit + 1)
+    )
+    alerts = [anwer_alert_from_row(row) for row in rows[:limit]]
+    next_cursor = str(alerts[-1]["id"]) if len(rows) > limit else None
+    return alerts, next_cursor
+
+def anwer_user_alerts_version(user_id):
+    """أول وآخر رقم تنبيه للمستخدم (من الفهرس مباشرة): التنبيهات لا تتغير بعد حفظها وتُحذف
+    من الأقدم فقط، فيتغير أحدهما مع أي تغيير في سجل المستخدم"""
+    return tuple(anwer_query_alerts(
+        "SELECT (SELECT MIN(id) FROM alerts WHERE user_id = ?), (SELECT MAX(id) FROM alerts WHERE user_id = ?)",
+        (user_id, user_id)
+    )[0])
+
+def anwer_count_user_alerts(user_id):
+    """عدد تنبيهات المستخدم"""
+    try:
+        return anwer_query_alerts("SELECT COUNT(*) FROM alerts WHERE user_id = ?", (user_id,))[0][0]
+    except Exception as e:
+        logger.error(f"خطأ في عدّ التنبيهات: {e}")
+    return 0
+
+def anwer_stats_buckets(period, since=None, until=None):
+    """قائمة الفترات الزمنية (ساعات أو أيام) في المدى المطلوب، بصيغة بادئة وقت التنبيه"""
+    if period not in ANWER_STATS_PERIODS:
+        raise ValueError(f"فترة غير معروفة: {period}")
+
+    step = timedelta(hours=1) if period == "hour" else timedelta(days=1)
+    bucket_format = '%Y-%m-%d %H' if period == "hour" else '%Y-%m-%d'
+    end = datetime.fromisoformat(anwer_normalize_timestamp(until)) if until else datetime.now()
+    start = datetime.fromisoformat(anwer_normalize_timestamp(since)) if since else end - ANWER_STATS_DEFAULT_SPAN[period] + step
+    start = max(start, end - step * (ANWER_STATS_MAX_BUCKETS - 1))
+
+    buckets = []
+    current = datetime.strptime(start.strftime(bucket_format), bucket_format)
+    while current <= end:
+        buckets.append(current.strftime(bucket_format))
+        current += step
+    return buckets
+
+def anwer_query_user_stats(user_id, period="day", since=None, until=None, dimension=None, value=None, top=10):
+    """عدد التنبيهات عبر الزمن وأكثر الكلمات والمجموعات والمرسلين من الملخصات (دون قراءة التنبيهات نفسها)"""
+    if dimension is not None and dimension not in ANWER_STATS_DIMENSIONS:
+        raise ValueError(f"بُعد غير معروف: {dimension}")
+
+    buckets = anwer_stats_buckets(period, since, until)
+    if not buckets:
+        return {"period": period, "series": [], "top": {name: [] for name in ANWER_STATS_DIMENSIONS}}
+
+    bucket_range = (user_id, period, buckets[0], buckets[-1])
+    counts = dict(anwer_query_alerts(
+        """SELECT bucket, count FROM alert_rollups
+           WHERE user_id = ? AND period = ? AND bucket BETWEEN ? AND ? AND dimension = ? AND value = ?""",
+        (*bucket_range, dimension or "total", value or "")
+    ))
+
+    top_values = {}
+    for name in ANWER_STATS_DIMENSIONS:
+        rows = anwer_query_alerts(
+            """SELECT value, MAX(label), SUM(count) AS total FROM alert_rollups
+               WHERE user_id = ? AND period = ? AND bucket BETWEEN ? AND ? AND dimension = ?
+               GROUP BY value ORDER BY total DESC, value LIMIT ?""",
+            (*bucket_range, name, top)
+        )
+        top_values[name] = [{"value": row[0], "label": row[1], "count": row[2]} for row in rows]
+
+    return {
+        "period": period,
+        "series": [{"bucket": bucket, "count": counts.get(bucket, 0)} for bucket in buckets],
+        "top": top_values,
+    }
+
+def anwer_search_terms(query):
+    """كلمات الاستعلام بعد التطبيع (نفس تطبيع النص المفهرس)"""
+    return ANWER_SEARCH_TERM_RE.findall(anwer_normalize_text(query))[:ANWER_SEARCH_MAX_TERMS]
+
+def anwer_search_user_alerts(user_id, query, limit=50, offset=0):
+    """البحث في تنبيهات المستخدم مرتبة حسب الصلة (BM25)، مع إزاحة الصفحة التالية"""
+    terms = anwer_search_terms(query)
+    if not terms:
+        return [], terms, None
+
+    # كل كلمة تطابق كبادئة في حقول التنبيه، والمستخدم يُقيَّد داخل الفهرس نفسه
+    prefixes = " ".join(f'"{term}"*' for term in terms)
+    match = f'user_id : {anwer_search_user_token(user_id)} AND {{message keywords sender chat_title}} : ({prefixes})'
+    rows = anwer_query_alerts(
+        """SELECT alerts.*, hits.rank AS score FROM (
+               SELECT rowid, rank FROM alerts_fts
+               WHERE alerts_fts MATCH ? AND rank MATCH 'bm25(4.0, 2.0, 1.0, 1.0, 0.0)'
+               ORDER BY rank LIMIT ? OFFSET ?
+           ) AS hits JOIN alerts ON alerts.id = hits.rowid
+           ORDER BY hits.rank""",
+        (match, limit + 1, offset)
+    )
+    alerts = [anwer_alert_from_row(row) for row in rows[:limit]]
+    next_offset = offset + limit if len(rows) > limit else None
+    return alerts, terms, next_offset
+
+def anwer_highlight_text(text, terms, snippet_chars=None):
+    """تمييز كلمات البحث في النص الأصلي بوسم <mark> (HTML آمن)، مع مقتطف حول أول تطابق"""
+    text = text or ''
+    # النص المُطبّع مع موضع كل حرف منه في النص الأصلي (التطبيع يحذف التشكيل فتختلف المواضع)
+    normalized, positions = [], []
+    for index, char in enumerate(text):
+        for mapped in anwer_normalize_text(char):
+            normalized.append(mapped)
+            positions.append(index)
+    positions.append(len(text))
+
+    pattern = re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, sorted(terms, key=len, reverse=True))) + r')\w*')
+    spans = [
+        (positions[m.start()], positions[m.end()])
+        for m in pattern.finditer(''.join(normalized))
+    ] if terms else []
+
+    start, end = 0, len(text)
+    if snippet_chars and len(text) > snippet_chars:
+        start = max(0, (spans[0][0] if spans else 0) - snippet_chars // 4)
+        end = min(len(text), start + snippet_chars)
+
+    parts = ['…'] if start > 0 else []
+    cursor = start
+    for span_start, span_end in spans:
+        span_start, span_end = max(span_start, cursor), min(span_end, end)
+        if span_start >= span_end:
+            continue
+        parts.append(html.escape(text[cursor:span_start]))
+        parts.append(f"<mark>{html.escape(text[span_start:span_end])}</mark>")
+        cursor = span_end
+    parts.append(html.escape(text[cursor:end]))
+    if end < len(text):
+        parts.append('…')
+    return ''.join(parts)
+
+def anwer_save_alert(user_id, alert):
+    """حفظ تنبيه جديد (يُكتب ضمن دفعة)"""
+    anwer_alert_write_buffer.append(anwer_alert_row(user_id, alert))
+    if len(anwer_alert_write_buffer) >= ANWER_ALERT_BATCH_SIZE:
+        return anwer_flush_alerts()
+    return True
+
 async def anwer_create_notifications_chat(client, chat_name="التنبيهات"):
     """إنشاء محادثة التنبيهات إذا لم تكن موجودة"""
     try:
@@ -137,22 +1648,25 @@ async def anwer_create_notifications_chat(client, chat_name="التنبيهات"
         logger.error(f"خطأ في إنشاء محادثة التنبيهات: {e}")
         return None
 
-async def anwer_send_notification(client, user_id, keyword, message_text, sender_info, chat_info):
-    """إرسال تنبيه للمحادثة الخاصة"""
-    try:
-        settings = anwer_load_user_settings(user_id)
-        notifications_chat = settings.get("notifications_chat", "التنبيهات")
+async def anwer_get_notification_target(client, user_id, chat_name):
+    """الحصول على محادثة التنبيهات من الذاكرة أو البحث عنها مرة واحدة"""
+    cached_target = anwer_notification_targets.get(user_id)
+    if cached_target and cached_target[0] == chat_name:
+        return cached_target[1]
 
-        # إنشاء أو العثور على محادثة التنبيهات
-        target_chat = await anwer_create_notifications_chat(client, notifications_chat)
-        if not target_chat:
-            logger.error("لا يمكن العثور على محادثة التنبيهات")
-            return
+    target_chat = await anwer_create_notifications_chat(client, chat_name)
+    if not target_chat:
+        return None
+
+    target_peer = get_input_peer(target_chat)
+    anwer_notification_targets[user_id] = (chat_name, target_peer)
+    return target_peer
 
-        # تكوين رسالة التنبيه
-        notification_text = f"""🚨 تنبيه كلمة مراقبة 🚨
+def anwer_format_notification(keywords, message_text, sender_info, chat_info):
+    """تكوين نص رسالة التنبيه"""
+    return f"""🚨 تنبيه كلمة مراقبة 🚨
 
-🔍 الكلمة المراقبة: {keyword}
+🔍 الكلمة المراقبة: {"، ".join(keywords)}
 👤 المرسل: {sender_info.get('name', 'غير معروف')} (@{sender_info.get('username', 'غير متوفر')})
 💬 المجموعة: {chat_info.get('title', 'غير معروف')}
 🔗 رابط المجموعة: {chat_info.get('link', 'غير متوفر')}
@@ -163,28 +1677,360 @@ async def anwer_send_notification(client, user_id, keyword, message_text, sender
 ⏰ الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
 
-        # إرسال التنبيه
-        await client.send_message(target_chat, notification_text)
-
-        # حفظ التنبيه في الملف
-        alert_data = {
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "keyword": keyword,
-            "message": message_text[:200] + "..." if len(message_text) > 200 else message_text,
-            "sender_name": sender_info.get('name', 'غير معروف'),
-            "sender_username": f"@{sender_info.get('username', 'غير متوفر')}",
-            "chat_title": chat_info.get('title', 'غير معروف'),
-            "chat_link": chat_info.get('link', 'غير متوفر'),
-            "chat_link_type": chat_info.get('link_type', 'unknown'),
-            "chat_id": chat_info.get('id', 0)
+def anwer_format_notification_batch(matches):
+    """تكوين رسالة واحدة تجمع عدة تنبيهات أثناء الذروة"""
+    lines = [f"🚨 {len(matches)} تنبيهات كلمات مراقبة 🚨", ""]
+    for match in matches:
+        message_text = match["message_text"]
+        lines.append(f"🔍 {'، '.join(match['keywords'])} | 💬 {match['chat_info'].get('title', 'غير معروف')}"
+                     f" | 👤 {match['sender_info'].get('name', 'غير معروف')}")
+        lines.append(f"📝 {message_text[:150]}{'...' if len(message_text) > 150 else ''}")
+        lines.append(f"🔗 {match['chat_info'].get('link', 'غير متوفر')}")
+        lines.append("")
+    lines.append(f"⏰ الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return "\n".join(lines)
+
+def anwer_build_alert_data(keywords, message_text, sender_info, chat_info):
+    """تكوين بيانات التنبيه للحفظ"""
+    return {
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "keyword": "، ".join(keywords),
+        "keywords": list(keywords),
+        "message": message_text[:200] + "..." if len(message_text) > 200 else message_text,
+        "sender_name": sender_info.get('name', 'غير معروف'),
+        "sender_username": f"@{sender_info.get('username', 'غير متوفر')}",
+        "chat_title": chat_info.get('title', 'غير معروف'),
+        "chat_link": chat_info.get('link', 'غير متوفر'),
+        "chat_link_type": chat_info.get('link_type', 'unknown'),
+        "chat_id": chat_info.get('id', 0),
+        "sender_id": sender_info.get('id')
+    }
+
+async def anwer_deliver_notification(client, user_id, notification_text):
+    """إرسال نص التنبيه لمحادثة التنبيهات مع احترام حد الإرسال و FloodWait"""
+    settings = anwer_load_user_settings(user_id)
+    notifications_chat = settings.get("notifications_chat", "التنبيهات")
+    bucket = anwer_rate_limiters.setdefault(user_id, AnwerTokenBucket(ANWER_NOTIFY_RATE, ANWER_NOTIFY_BURST))
+    stats = anwer_get_dispatch_stats(user_id)
+
+    # إنشاء أو العثور على محادثة التنبيهات
+    target_chat = await anwer_get_notification_target(client, user_id, notifications_chat)
+    if not target_chat:
+        logger.error("لا يمكن العثور على محادثة التنبيهات")
+        return False
+
+    for attempt in range(ANWER_NOTIFY_MAX_ATTEMPTS):
+        await bucket.acquire()
+        started_at = time.perf_counter()
+        try:
+            await client.send_message(target_chat, notification_text)
+            anwer_notification_latency.observe(time.perf_counter() - started_at)
+            return True
+        except FloodWaitError as e:
+            # انتظار المدة التي يطلبها تليجرام ثم إعادة المحاولة بدلاً من فقدان التنبيه
+            logger.warning(f"⏳ FloodWait للمستخدم {user_id}: انتظار {e.seconds} ثانية")
+            stats.flood_waits += 1
+            stats.flood_wait_seconds += e.seconds
+            bucket.pause(e.seconds)
+        except ANWER_PEER_ERRORS as e:
+            # محادثة التنبيهات لم تعد صالحة، إعادة البحث عنها مرة أخرى
+            logger.warning(f"محادثة التنبيهات لم تعد صالحة للمستخدم {user_id}: {e}")
+            anwer_notification_targets.pop(user_id, None)
+            target_chat = await anwer_get_notification_target(client, user_id, notifications_chat)
+            if not target_chat:
+                logger.error("لا يمكن العثور على محادثة التنبيهات")
+                return False
+
+    return False
+
+async def anwer_build_match_info(event, entity_cache=None):
+    """جمع معلومات المرسل والمحادثة للرسالة المطابقة (من الذاكرة إن أمكن)"""
+    sender_key = ("sender", event.sender_id)
+    chat_key = ("chat", event.chat_id)
+
+    # جمع معلومات المرسل
+    sender_info = entity_cache.get(sender_key) if entity_cache else None
+    if sender_info is None:
+        sender = await event.get_sender()
+        sender_info = {
+            'name': f"{getattr(sender, 'first_name', '') or ''} {getattr(sender, 'last_name', '') or ''}".strip(),
+            'username': getattr(sender, 'username', '') or '',
+            'id': event.sender_id
         }
+        if entity_cache and event.sender_id is not None:
+            entity_cache.set(sender_key, sender_info)
+
+    # جمع معلومات المحادثة
+    chat_info = entity_cache.get(chat_key) if entity_cache else None
+    if chat_info is None:
+        chat = await event.get_chat()
+        chat_info = {
+            'title': getattr(chat, 'title', 'محادثة خاصة'),
+            'id': chat.id,
+            'link': f"tg://openmessage?chat_id={chat.id}",
+            'link_type': 'group' if hasattr(chat, 'username') and chat.username else 'private'
+        }
+
+        if hasattr(chat, 'username') and chat.username:
+            chat_info['link'] = f"https://t.me/{chat.username}"
+            chat_info['link_type'] = 'public'
+
+        if entity_cache and event.chat_id is not None:
+            entity_cache.set(chat_key, chat_info)
+
+    return sender_info, chat_info
+
+def anwer_invalidate_entity_update(entity_cache, update):
+    """حذف معلومات المحادثة أو المرسل من الذاكرة عند تغيّر الاسم أو المعرّف"""
+    if isinstance(update, UpdateChannel):
+        entity_cache.invalidate(("chat", get_peer_id(PeerChannel(update.channel_id))))
+    elif isinstance(update, UpdateChat):
+        entity_cache.invalidate(("chat", get_peer_id(PeerChat(update.chat_id))))
+    elif isinstance(update, UpdateUserName):
+        entity_cache.invalidate(("sender", update.user_id))
+
+def anwer_get_dispatch_stats(user_id):
+    """عدادات طابور التنبيهات للمستخدم (تُنشأ مرة واحدة، ويحتفظ المستدعي المتكرر بمرجعها)"""
+    stats = anwer_dispatch_stats.get(user_id)
+    if stats is None:
+        stats = anwer_dispatch_stats[user_id] = AnwerDispatchStats()
+    return stats
+
+async def anwer_enqueue_alert(user_id, event, keywords, message_text, stats=None):
+    """إضافة تطابق لطابور التنبيهات، مع الانتظار قليلاً ثم الإسقاط إذا امتلأ"""
+    queue = anwer_alert_queues.get(user_id)
+    if queue is None:
+        return False
+
+    if stats is None:
+        stats = anwer_get_dispatch_stats(user_id)
+    item = {"event": event, "keywords": keywords, "message_text": message_text}
+    try:
+        queue.put_nowait(item)
+    except asyncio.QueueFull:
+        try:
+            # ضغط عكسي: إبطاء معالجة الأحداث قليلاً قبل إسقاط التنبيه
+            await asyncio.wait_for(queue.put(item), timeout=ANWER_ALERT_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.dropped += 1
+            logger.warning(f"⚠️ طابور التنبيهات ممتلئ للمستخدم {user_id}، تم إسقاط تنبيه ({stats.dropped} إجمالاً)")
+            return False
+
+    stats.enqueued += 1
+    return True
 
-        anwer_save_alert(user_id, alert_data)
+def anwer_format_dedup_summary(summary, chat_titles):
+    """تكوين تنبيه مُجمّع لرسالة تكررت في عدة مجموعات"""
+    message_text = summary["message_text"]
+    return f"""🔁 رسالة مكررة 🔁
 
-        logger.info(f"✅ تم إرسال تنبيه للمستخدم {user_id}")
+🔍 الكلمة المراقبة: {"، ".join(summary["keywords"])}
+📊 ظهرت في {summary["suppressed"]} رسالة أخرى في {len(summary["chat_ids"])} مجموعة
+💬 المجموعات: {"، ".join(chat_titles)}
+
+📝 نص الرسالة:
+{message_text[:300]}{'...' if len(message_text) > 300 else ''}
+"""
+
+async def anwer_send_dedup_summaries(user_id, client, everything=False):
+    """إرسال تنبيه واحد لكل رسالة مكررة انتهت نافذتها (أو لكل الرسائل المكررة المعلقة عند الإغلاق)"""
+    dedup = anwer_dedup_windows.get(user_id)
+    if dedup is None:
+        return
+
+    entity_cache = anwer_entity_caches.get(user_id)
+    for summary in dedup.pop_expired(everything):
+        chat_titles = []
+        for chat_id in list(summary["chat_ids"])[:10]:
+            chat_info = entity_cache.get(("chat", chat_id)) if entity_cache else None
+            chat_titles.append(chat_info["title"] if chat_info else str(chat_id))
+
+        # الملخص إشعار فقط: أول نسخة من الرسالة محفوظة كتنبيه بمرسلها ومجموعتها الفعليين، فلا يدخل
+        # الملخص في سجل التنبيهات أو البحث أو الإحصائيات
+        await anwer_deliver_notification(client, user_id, anwer_format_dedup_summary(summary, chat_titles))
+
+def anwer_start_dispatch_worker(user_id):
+    """إنشاء طابور التنبيهات وتشغيل عامل الإرسال للمستخدم إذا لم يكونا موجودين"""
+    queue = anwer_alert_queues.get(user_id)
+    if queue is None:
+        queue = anwer_alert_queues[user_id] = asyncio.Queue(maxsize=ANWER_ALERT_QUEUE_SIZE)
+    worker = anwer_dispatch_workers.get(user_id)
+    if worker is None or worker.done():
+        anwer_dispatch_workers[user_id] = asyncio.create_task(anwer_alert_dispatch_worker(user_id))
+    return queue
+
+async def anwer_alert_dispatch_worker(user_id):
+    """إرسال التنبيهات من الطابور، ودمجها في رسالة واحدة عند الذروة"""
+    queue = anwer_alert_queues[user_id]
+    stats = anwer_get_dispatch_stats(user_id)
+    items = []
+
+    while True:
+        if not items:
+            try:
+                items = [await asyncio.wait_for(queue.get(), timeout=ANWER_DEDUP_SWEEP_INTERVAL)]
+            except asyncio.TimeoutError:
+                items = []
+            while items and len(items) < ANWER_NOTIFY_BATCH_MAX and not queue.empty():
+                items.append(queue.get_nowait())
+
+        # العميل الحالي (قد يتغير بعد إعادة تسجيل الدخول)، والانتظار حتى يعود الاتصال
+        client = anwer_clients.get(user_id)
+        if client is None or not client.is_connected():
+            await asyncio.sleep(ANWER_DISPATCH_RECONNECT_POLL)
+            continue
+
+        retry = False
+        try:
+            await anwer_send_dedup_summaries(user_id, client)
+            if not items:
+                continue
+
+            matches = []
+            for item in items:
+                sender_info, chat_info = await anwer_build_match_info(item["event"], anwer_entity_caches.get(user_id))
+                matches.append({
+                    "keywords": item["keywords"],
+                    "message_text": item["message_text"],
+                    "sender_info": sender_info,
+                    "chat_info": chat_info
+                })
+
+            if len(matches) == 1:
+                match = matches[0]
+                notification_text = anwer_format_notification(
+                    match["keywords"], match["message_text"], match["sender_info"], match["chat_info"]
+                )
+            else:
+                notification_text = anwer_format_notification_batch(matches)
+
+            if await anwer_deliver_notification(client, user_id, notification_text):
+                stats.sent += len(matches)
+                if len(matches) > 1:
+                    stats.batched += len(matches)
+                for match in matches:
+                    anwer_save_alert(user_id, anwer_build_alert_data(
+                        match["keywords"], match["message_text"], match["sender_info"], match["chat_info"]
+                    ))
+                    logger.info(f"📨 تم رصد كلمات {match['keywords']} في {match['chat_info']['title']}")
+                anwer_flush_alerts()
+            elif not client.is_connected():
+                raise ConnectionError("انقطع الاتصال أثناء الإرسال")
+            else:
+                stats.failed += len(matches)
+
+        except asyncio.CancelledError:
+            raise
+        except ConnectionError as e:
+            # مثل FloodWait: الاحتفاظ بالتنبيهات وإعادة إرسالها بعد عودة الاتصال
+            # (مواضع المحادثات تجاوزت هذه الرسائل فلن يعيد فحص الفائت اكتشافها)
+            logger.warning(f"⏳ انقطع الاتصال أثناء إرسال {len(items)} تنبيه للمستخدم {user_id}: {e}")
+            retry = True
+        except Exception as e:
+            stats.failed += len(items)
+            logger.error(f"خطأ في إرسال التنبيه: {e}")
+        finally:
+            if not retry:
+                for _ in items:
+                    queue.task_done()
+                items = []
+
+def anwer_chat_positions_file(user_id):
+    """ملف آخر رسالة تمت معالجتها في كل محادثة للمستخدم"""
+    return anwer_users_dir / f"anwer_positions_{user_id}.json"
+
+def anwer_load_chat_positions(user_id):
+    """آخر رسالة تمت معالجتها لكل محادثة: {chat_id: message_id}"""
+    positions = anwer_chat_positions.get(user_id)
+    if positions is None:
+        positions = {}
+        positions_file = anwer_chat_positions_file(user_id)
+        if positions_file.exists():
+            try:
+                with open(positions_file, 'r', encoding='utf-8') as f:
+                    positions = {int(chat_id): message_id for chat_id, message_id in json.load(f).items()}
+            except Exception as e:
+                logger.error(f"خطأ في تحميل مواضع المحادثات: {e}")
+        anwer_chat_positions[user_id] = positions
+    return positions
+
+def anwer_save_chat_positions():
+    """حفظ مواضع المحادثات التي تغيّرت منذ آخر حفظ"""
+    dirty = list(anwer_chat_positions_dirty)
+    anwer_chat_positions_dirty.clear()
+    for user_id in dirty:
+        positions_file = anwer_chat_positions_file(user_id)
+        temp_file = positions_file.with_name(f"{positions_file.name}.tmp")
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(anwer_chat_positions[user_id], f)
+            os.replace(temp_file, positions_file)
+        except Exception as e:
+            logger.error(f"خطأ في حفظ مواضع المحادثات: {e}")
+            anwer_chat_positions_dirty.add(user_id)
 
+async def anwer_chat_positions_save_loop():
+    """حفظ مواضع المحادثات بشكل دوري"""
+    while True:
+        await asyncio.sleep(ANWER_CATCHUP_SAVE_INTERVAL)
+        anwer_save_chat_positions()
+
+async def anwer_catch_up_chat(client, dialog, last_id, limit, process, semaphore):
+    """جلب رسائل محادثة واحدة بعد آخر رسالة معالجة (دفعات من 100) وتمريرها للمطابقة،
+    وإرجاع (عدد الرسائل، هل توقف الجلب عند الحد قبل الوصول لأحدث رسالة)"""
+    count = 0
+    newest_id = last_id
+    async with semaphore:
+        async for message in client.iter_messages(dialog.entity, min_id=last_id, limit=limit, reverse=True):
+            if anwer_shutting_down:
+                break
+            await process(message)
+            count += 1
+            newest_id = message.id
+    return count, count >= limit and newest_id < dialog.message.id
+
+async def anwer_catch_up(user_id, client, positions, process):
+    """فحص الرسائل التي وصلت أثناء انقطاع الاتصال أو إعادة التشغيل"""
+    catch_up = anwer_load_user_settings(user_id).get("catch_up") or {}
+    if not catch_up.get("enabled", True) or not positions:
+        return
+
+    max_gap = catch_up.get("max_gap", 500)
+    stats = anwer_get_dispatch_stats(user_id)
+    semaphore = asyncio.Semaphore(ANWER_CATCHUP_CONCURRENCY)
+    dialogs, jobs = [], []
+    try:
+        # آخر رسالة في كل محادثة تأتي مع قائمة المحادثات (طلب لكل 100 محادثة)
+        async for dialog in client.iter_dialogs():
+            last_id = positions.get(dialog.id)
+            if last_id is None or dialog.message is None:
+                continue
+
+            # في المجموعات العادية الأرقام مشتركة مع بقية محادثات الحساب، فالفجوة حد أعلى فقط:
+            # نجلب ما بعد آخر رسالة حتى max_gap رسالة بدل الحكم على المحادثة من الفرق بين الأرقام
+            if dialog.message.id <= last_id:
+                continue
+            dialogs.append(dialog)
+            jobs.append(anwer_catch_up_chat(client, dialog, last_id, max_gap, process, semaphore))
+
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        caught_up = 0
+        for dialog, result in zip(dialogs, results):
+            if isinstance(result, Exception):
+                logger.error(f"خطأ في جلب الرسائل الفائتة للمستخدم {user_id}: {result}")
+                continue
+            count, truncated = result
+            caught_up += count
+            if truncated:
+                stats.catch_up_truncated += 1
+                logger.warning(f"⏭️ توقف فحص الرسائل الفائتة في {dialog.name} عند {max_gap} رسالة للمستخدم {user_id}")
+        stats.caught_up += caught_up
+        if caught_up:
+            logger.info(f"📥 تم فحص {caught_up} رسالة فائتة في {len(jobs)} محادثة للمستخدم {user_id}")
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"خطأ في إرسال التنبيه: {e}")
+        logger.error(f"خطأ في فحص الرسائل الفائتة للمستخدم {user_id}: {e}")
 
 async def anwer_monitor_messages(user_id):
     """مراقبة الرسائل في المجموعات"""
@@ -195,90 +2041,441 @@ async def anwer_monitor_messages(user_id):
 
         client = anwer_clients[user_id]
         settings = anwer_load_user_settings(user_id)
-        keywords = settings.get("keywords", [])
+        anwer_get_rule_plan(user_id, settings)
 
-        @client.on(events.NewMessage)
-        async def anwer_message_handler(event):
+        entity_cache = anwer_entity_caches.setdefault(
+            user_id, AnwerEntityCache(ANWER_ENTITY_CACHE_SIZE, ANWER_ENTITY_CACHE_TTL)
+        )
+
+        dedup_settings = settings.get("dedup") or {}
+        dedup = anwer_dedup_windows.setdefault(user_id, AnwerDedupWindow(
+            dedup_settings.get("window_seconds", 600), ANWER_DEDUP_MAX_ENTRIES,
+            dedup_settings.get("min_similarity", 0.7), dedup_settings.get("enabled", True)
+        ))
+
+        metrics = anwer_message_metrics.setdefault(user_id, AnwerMessageMetrics())
+        dispatch_stats = anwer_get_dispatch_stats(user_id)
+
+        # المواضع قبل استقبال أي رسالة جديدة: ما بعدها وحتى أحدث رسالة هو ما فات
+        positions = anwer_load_chat_positions(user_id)
+        catch_up_from = dict(positions)
+
+        # طابور التنبيهات وعامل الإرسال الخاص بالمستخدم
+        anwer_start_dispatch_worker(user_id)
+
+        async def anwer_process_message(message):
+            """مطابقة رسالة (جديدة أو فائتة) وإضافتها لطابور التنبيهات"""
             try:
                 # التحقق من أن الرسالة من مجموعة
-                if not event.is_group and not event.is_channel:
+                if not message.is_group and not message.is_channel:
                     return
 
-                message_text = event.message.message or ""
-
-                # البحث عن الكلمات المراقبة
-                found_keyword = None
-                for keyword in keywords:
-                    if keyword.lower() in message_text.lower():
-                        found_keyword = keyword
-                        break
-
-                if found_keyword:
-                    # جمع معلومات المرسل
-                    sender = await event.get_sender()
-                    sender_info = {
-                        'name': getattr(sender, 'first_name', '') + ' ' + getattr(sender, 'last_name', ''),
-                        'username': getattr(sender, 'username', '')
-                    }
-
-                    # جمع معلومات المحادثة
-                    chat = await event.get_chat()
-                    chat_info = {
-                        'title': getattr(chat, 'title', 'محادثة خاصة'),
-                        'id': chat.id,
-                        'link': f"tg://openmessage?chat_id={chat.id}",
-                        'link_type': 'group' if hasattr(chat, 'username') and chat.username else 'private'
-                    }
-
-                    if hasattr(chat, 'username') and chat.username:
-                        chat_info['link'] = f"https://t.me/{chat.username}"
-                        chat_info['link_type'] = 'public'
-
-                    # إرسال التنبيه
-                    await anwer_send_notification(client, user_id, found_keyword, message_text, sender_info, chat_info)
-
-                    logger.info(f"📨 تم رصد كلمة '{found_keyword}' في {chat_info['title']}")
+                if message.id > positions.get(message.chat_id, 0):
+                    positions[message.chat_id] = message.id
+                    anwer_chat_positions_dirty.add(user_id)
+
+                metrics.seen += 1
+                message_text = message.message or ""
+
+                # تقييم قواعد المستخدم (الخطة تُحدَّث عند تغيير الإعدادات)
+                started_at = time.perf_counter()
+                found_keywords = anwer_shared_matcher.evaluate(user_id, message, message_text)
+                anwer_match_latency.observe(time.perf_counter() - started_at)
+
+                if found_keywords:
+                    metrics.matched += 1
+
+                    # تجاهل الرسائل المكررة داخل النافذة (يُرسل عنها تنبيه مُجمّع لاحقاً)
+                    if dedup.enabled and not dedup.check(message_text, found_keywords, message.chat_id):
+                        dispatch_stats.suppressed += 1
+                        return
+
+                    await anwer_enqueue_alert(user_id, message, found_keywords, message_text, dispatch_stats)
 
             except Exception as e:
                 logger.error(f"خطأ في معالجة الرسالة: {e}")
 
-        # بدء المراقبة
-        await client.run_until_disconnected()
+        async def anwer_message_handler(event):
+            if not anwer_shutting_down:
+                await anwer_process_message(event.message)
+
+        async def anwer_entity_update_handler(event):
+            anwer_invalidate_entity_update(entity_cache, event)
+
+        async def anwer_title_change_handler(event):
+            if event.new_title:
+                entity_cache.invalidate(("chat", event.chat_id))
+
+        entity_update_event = events.Raw(types=(UpdateChannel, UpdateChat, UpdateUserName))
+        client.add_event_handler(anwer_message_handler, events.NewMessage)
+        client.add_event_handler(anwer_entity_update_handler, entity_update_event)
+        client.add_event_handler(anwer_title_change_handler, events.ChatAction)
+        catch_up_task = asyncio.create_task(anwer_catch_up(user_id, client, catch_up_from, anwer_process_message))
+        try:
+            # بدء المراقبة
+            await client.run_until_disconnected()
+        finally:
+            client.remove_event_handler(anwer_message_handler, events.NewMessage)
+            client.remove_event_handler(anwer_entity_update_handler)
+            client.remove_event_handler(anwer_title_change_handler, events.ChatAction)
+            catch_up_task.cancel()
+            if anwer_rule_plans.pop(user_id, None) is not None:
+                anwer_shared_matcher.invalidate(user_id)
 
     except Exception as e:
         logger.error(f"خطأ في مراقبة الرسائل للمستخدم {user_id}: {e}")
 
+def anwer_load_monitoring_state():
+    """المستخدمون الذين كانت المراقبة تعمل لديهم {user_id: وقت آخر تغيير}"""
+    # قراءة ملفات جميع العمال حتى يستأنف العامل مراقبة المستخدمين المنقولين إليه؛ لكل مستخدم
+    # آخر تغيير أينما كان، فإيقاف المراقبة عند المالك الحالي يغلب ملفات العمال الميتين أو السابقين
+    state = {}
+    for state_file in anwer_state_files("anwer_monitoring*.json"):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, list):
+                # الصيغة القديمة: قائمة المفعّلين فقط، ووقت تغييرهم هو وقت الملف
+                changed_at = state_file.stat().st_mtime
+                entries = {user_id: {"enabled": True, "changed_at": changed_at} for user_id in entries}
+            for user_id, entry in entries.items():
+                if user_id not in state or entry["changed_at"] > state[user_id]["changed_at"]:
+                    state[user_id] = entry
+        except Exception as e:
+            logger.error(f"خطأ في تحميل حالة المراقبة: {e}")
+    return {user_id: entry["changed_at"] for user_id, entry in state.items() if entry["enabled"]}
+
+def anwer_save_monitoring_state():
+    """حفظ حالة المراقبة لكل مستخدم تغيّرت لديه في هذا العامل لاستئنافها بعد إعادة التشغيل"""
+    temp_file = anwer_monitoring_state_file.with_name(f"{anwer_monitoring_state_file.name}.{os.getpid()}.tmp")
+    try:
+        state = {
+            user_id: {"enabled": user_id in anwer_monitoring_enabled, "changed_at": changed_at}
+            for user_id, changed_at in sorted(anwer_monitoring_changed_at.items())
+        }
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_file, anwer_monitoring_state_file)
+    except Exception as e:
+        logger.error(f"خطأ في حفظ حالة المراقبة: {e}")
+        temp_file.unlink(missing_ok=True)
+
+def anwer_set_monitoring_enabled(user_id, enabled):
+    """تفعيل أو إلغاء المراقبة المطلوبة للمستخدم وحفظ ذلك"""
+    if enabled == (user_id in anwer_monitoring_enabled):
+        return
+    if enabled:
+        anwer_monitoring_enabled.add(user_id)
+    else:
+        anwer_monitoring_enabled.discard(user_id)
+    anwer_monitoring_changed_at[user_id] = time.time()
+    anwer_save_monitoring_state()
+
+def anwer_session_file(user_id, phone):
+    """مسار ملف جلسة تليجرام للمستخدم"""
+    return anwer_users_dir / f"anwer_session_{user_id}_{phone.replace('+', '')}.session"
+
+def anwer_owns_user(user_id):
+    """هل هذا العامل هو المالك الحالي للمستخدم (دائماً في وضع العملية الواحدة)"""
+    if ANWER_SHARD_COUNT == 1:
+        return True
+    from anwer_shards import anwer_shard_owner
+    return anwer_shard_owner(user_id, anwer_shard_alive) == ANWER_SHARD_INDEX
+
+def anwer_state_files(pattern):
+    """ملفات الحالة لجميع العمال (الحاليين والسابقين) من الأقدم تعديلاً للأحدث"""
+    files = []
+    for state_file in anwer_users_dir.glob(pattern):
+        try:
+            files.append((state_file.stat().st_mtime, state_file))
+        except OSError:
+            continue
+    return [state_file for _, state_file in sorted(files)]
+
+def anwer_find_persisted_sessions():
+    """البحث عن ملفات الجلسات المحفوظة: {user_id: ملف الجلسة}"""
+    candidates = {}
+    for session_file in anwer_users_dir.glob("anwer_session_*.session"):
+        user_id, _, phone = session_file.stem[len("anwer_session_"):].rpartition('_')
+        if user_id:
+            candidates.setdefault(user_id, []).append((phone, session_file))
+
+    sessions = {}
+    for user_id, files in candidates.items():
+        # عند وجود أكثر من جلسة للمستخدم: جلسة الرقم الحالي في الإعدادات، وإلا الأحدث
+        settings_phone = anwer_load_user_settings(user_id).get("phone", "").replace('+', '')
+        sessions[user_id] = max(files, key=lambda f: (f[0] == settings_phone, f[1].stat().st_mtime))[1]
+
+    # في وضع العمال المتعددين يستعيد كل عامل مستخدميه فقط
+    return {user_id: session_file for user_id, session_file in sessions.items() if anwer_owns_user(user_id)}
+
+async def anwer_restore_session(user_id, session_file, semaphore):
+    """إعادة اتصال جلسة محفوظة إذا كانت مصرحاً بها"""
+    settings = anwer_load_user_settings(user_id)
+    async with semaphore:
+        client = anwer_create_client(
+            session_file, settings.get("api_id", DEFAULT_API_ID), settings.get("api_hash", DEFAULT_API_HASH)
+        )
+        try:
+            await asyncio.wait_for(client.connect(), timeout=ANWER_RESTORE_TIMEOUT)
+            authorized = await client.is_user_authorized()
+        except Exception as e:
+            logger.error(f"خطأ في استعادة جلسة المستخدم {user_id}: {e}")
+            authorized = False
+
+        if not authorized:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return False
+
+    anwer_clients[user_id] = client
+    return True
+
+async def anwer_restore_sessions():
+    """استعادة الجلسات المحفوظة بالتوازي المحدود واستئناف المراقبة"""
+    try:
+        anwer_readiness["stage"] = "restoring_sessions"
+        sessions = {
+            user_id: session_file for user_id, session_file in anwer_find_persisted_sessions().items()
+            if user_id not in anwer_clients
+        }
+        anwer_readiness["sessions_total"] += len(sessions)
+        monitoring_state = anwer_load_monitoring_state()
+
+        semaphore = asyncio.Semaphore(ANWER_RESTORE_CONCURRENCY)
+
+        async def restore(user_id, session_file):
+            if not await anwer_restore_session(user_id, session_file, semaphore):
+                anwer_readiness["sessions_failed"] += 1
+                return
+            anwer_readiness["sessions_restored"] += 1
+
+            # استئناف المراقبة فور عودة الجلسة دون انتظار بقية الجلسات
+            if user_id in monitoring_state:
+                anwer_monitoring_enabled.add(user_id)
+                anwer_monitoring_changed_at.setdefault(user_id, monitoring_state[user_id])
+                anwer_start_monitoring_task(user_id)
+                anwer_readiness["monitoring_resumed"] += 1
+
+        # جلسات المستخدمين الذين كانت المراقبة تعمل لديهم أولاً (الإشارة تخدم الطلبات بالترتيب)
+        ordered = sorted(sessions.items(), key=lambda item: item[0] not in monitoring_state)
+        await asyncio.gather(*(restore(user_id, session_file) for user_id, session_file in ordered))
+        anwer_save_monitoring_state()
+
+        logger.info(f"✅ تمت استعادة الجلسات: {anwer_readiness}")
+    except Exception as e:
+        logger.error(f"خطأ في استعادة الجلسات: {e}")
+    finally:
+        if not anwer_shutting_down:
+            anwer_readiness["stage"] = "ready"
+
+def anwer_start_monitoring_task(user_id):
+    """تشغيل مهمة المراقبة للمستخدم إذا لم تكن تعمل"""
+    task = anwer_monitoring_tasks.get(user_id)
+    if task is None or task.done():
+        task = asyncio.create_task(anwer_monitor_messages(user_id))
+        task.add_done_callback(lambda _: anwer_publish_status(user_id))
+        anwer_monitoring_tasks[user_id] = task
+        anwer_publish_status(user_id)
+    return task
+
+def anwer_load_auto_send_schedule():
+    """تحميل مواعيد الإرسال التلقائي المحفوظة من ملفات جميع العمال (الملف الأحدث يفوز عند التكرار)"""
+    schedule = {}
+    for schedule_file in anwer_state_files("anwer_schedule*.json"):
+        try:
+            with open(schedule_file, 'r', encoding='utf-8') as f:
+                schedule.update(json.load(f))
+        except Exception as e:
+            logger.error(f"خطأ في تحميل مواعيد الإرسال التلقائي: {e}")
+    return schedule
+
+def anwer_save_auto_send_schedule():
+    """حفظ مواعيد الإرسال التلقائي حتى لا تتراكم الإرسالات بعد إعادة التشغيل"""
+    temp_file = anwer_auto_send_schedule_file.with_name(f"{anwer_auto_send_schedule_file.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(anwer_auto_send_next_run, f)
+        os.replace(temp_file, anwer_auto_send_schedule_file)
+    except Exception as e:
+        logger.error(f"خطأ في حفظ مواعيد الإرسال التلقائي: {e}")
+        temp_file.unlink(missing_ok=True)
+
+def anwer_schedule_auto_send(user_id, next_run):
+    """جدولة الإرسال التلقائي التالي للمستخدم (وقت epoch بالثواني)"""
+    anwer_auto_send_next_run[user_id] = next_run
+    heapq.heappush(anwer_auto_send_heap, (next_run, user_id))
+    anwer_save_auto_send_schedule()
+    if anwer_auto_send_wakeup is not None:
+        anwer_auto_send_wakeup.set()
+
+def anwer_unschedule_auto_send(user_id):
+    """إلغاء جدولة الإرسال التلقائي (العناصر القديمة في الكومة تُتجاهل لاحقاً)"""
+    if anwer_auto_send_next_run.pop(user_id, None) is not None:
+        anwer_save_auto_send_schedule()
+
+def anwer_auto_send_interval(settings):
+    """الفترة بين الإرسالات بالثواني (بحد أدنى لحماية الحساب)"""
+    return max(ANWER_AUTO_SEND_MIN_INTERVAL, int(settings.get("auto_send_interval", 3600)))
+
+def anwer_on_auto_send_settings_changed(user_id, old_settings, new_settings):
+    """تحديث الجدولة عند تفعيل/إيقاف الإرسال التلقائي أو تغيير الفترة"""
+    if not new_settings.get("auto_send_enabled"):
+        anwer_unschedule_auto_send(user_id)
+        return
+
+    now = time.time()
+    interval = anwer_auto_send_interval(new_settings)
+    if not old_settings.get("auto_send_enabled") or user_id not in anwer_auto_send_next_run:
+        anwer_schedule_auto_send(user_id, now + random.uniform(0, ANWER_AUTO_SEND_JITTER))
+    elif anwer_auto_send_interval(old_settings) != interval:
+        anwer_schedule_auto_send(user_id, min(anwer_auto_send_next_run[user_id], now + interval))
+
+anwer_settings_listeners.append(anwer_on_auto_send_settings_changed)
+
+def anwer_restore_auto_send_schedule():
+    """استعادة مواعيد مستخدمي هذا العامل، مع توزيع المواعيد الفائتة بدل إرسالها دفعة واحدة
+    (تُعاد عند تغيّر العمال الأحياء: يتسلم العامل مواعيد المستخدمين المنقولين إليه)"""
+    now = time.time()
+    for user_id in [user_id for user_id in anwer_auto_send_next_run if not anwer_owns_user(user_id)]:
+        del anwer_auto_send_next_run[user_id]
+
+    for user_id, next_run in anwer_load_auto_send_schedule().items():
+        if user_id in anwer_auto_send_next_run or not anwer_owns_user(user_id):
+            continue
+        settings = anwer_load_user_settings(user_id)
+        if not settings.get("auto_send_enabled"):
+            continue
+        if next_run < now:
+            spread = min(anwer_auto_send_interval(settings), ANWER_AUTO_SEND_STARTUP_SPREAD)
+            next_run = now + random.uniform(0, spread)
+        anwer_auto_send_next_run[user_id] = next_run
+        heapq.heappush(anwer_auto_send_heap, (next_run, user_id))
+    anwer_save_auto_send_schedule()
+    if anwer_auto_send_wakeup is not None:
+        anwer_auto_send_wakeup.set()
+
+async def anwer_run_auto_send(user_id):
+    """إرسال الرسالة المحددة لمجموعات الإرسال التلقائي للمستخدم"""
+    settings = anwer_load_user_settings(user_id)
+    client = anwer_clients.get(user_id)
+    message = settings.get("message", "")
+    groups = settings.get("auto_send_groups", [])
+    result = {"time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "sent": 0, "failed": 0, "error": None}
+
+    if not client or not client.is_connected():
+        result["error"] = "العميل غير متصل"
+    elif not message or not groups:
+        result["error"] = "لا توجد رسالة أو مجموعات"
+    else:
+        for index, group in enumerate(groups):
+            if index:
+                # توزيع الإرسالات داخل الدورة بفواصل عشوائية
+                await asyncio.sleep(random.uniform(*ANWER_AUTO_SEND_GROUP_DELAY))
+            for attempt in range(2):
+                try:
+                    await client.send_message(group, message)
+                    result["sent"] += 1
+                    break
+                except FloodWaitError as e:
+                    logger.warning(f"⏳ FloodWait في الإرسال التلقائي للمستخدم {user_id}: انتظار {e.seconds} ثانية")
+                    if attempt or e.seconds > ANWER_AUTO_SEND_MAX_FLOOD_WAIT:
+                        # تأجيل الدورة التالية بدلاً من الانتظار الطويل هنا
+                        result["failed"] += len(groups) - index
+                        result["error"] = f"FloodWait {e.seconds}s"
+                        return result, e.seconds
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    logger.error(f"خطأ في الإرسال التلقائي إلى {group}: {e}")
+                    result["failed"] += 1
+                    break
+
+    logger.info(f"📤 الإرسال التلقائي للمستخدم {user_id}: {result}")
+    return result, 0
+
+async def anwer_auto_send_job(user_id):
+    """تنفيذ دورة إرسال واحدة ثم جدولة الدورة التالية"""
+    try:
+        result, flood_wait = await anwer_run_auto_send(user_id)
+    except Exception as e:
+        logger.error(f"خطأ في الإرسال التلقائي للمستخدم {user_id}: {e}")
+        result, flood_wait = {"time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "error": str(e)}, 0
+    finally:
+        anwer_auto_send_running.discard(user_id)
+
+    anwer_auto_send_results[user_id] = result
+    settings = anwer_load_user_settings(user_id)
+    if settings.get("auto_send_enabled") and user_id in anwer_auto_send_next_run:
+        delay = max(anwer_auto_send_interval(settings), flood_wait)
+        anwer_schedule_auto_send(user_id, time.time() + delay + random.uniform(0, ANWER_AUTO_SEND_JITTER))
+
+async def anwer_auto_send_scheduler():
+    """مجدول واحد (كومة مواعيد) للإرسال التلقائي لجميع المستخدمين"""
+    global anwer_auto_send_wakeup
+    anwer_auto_send_wakeup = asyncio.Event()
+    anwer_restore_auto_send_schedule()
+
+    while True:
+        try:
+            anwer_auto_send_wakeup.clear()
+
+            # تجاهل العناصر الملغاة أو التي أُعيدت جدولتها
+            while anwer_auto_send_heap and anwer_auto_send_next_run.get(anwer_auto_send_heap[0][1]) != anwer_auto_send_heap[0][0]:
+                heapq.heappop(anwer_auto_send_heap)
+
+            if not anwer_auto_send_heap:
+                await anwer_auto_send_wakeup.wait()
+                continue
+
+            next_run, user_id = anwer_auto_send_heap[0]
+            delay = next_run - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(anwer_auto_send_wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(anwer_auto_send_heap)
+            if user_id in anwer_auto_send_running:
+                continue
+            anwer_auto_send_running.add(user_id)
+            asyncio.create_task(anwer_auto_send_job(user_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"خطأ في مجدول الإرسال التلقائي: {e}")
+            await asyncio.sleep(1)
+
 @app.get("/anwer", response_class=HTMLResponse)
 async def anwer_home(request: Request):
     """الصفحة الرئيسية لمراقب Anwer"""
     user_id = str(uuid.uuid4())
     return RedirectResponse(f"/anwer/{user_id}", status_code=303)
 
+def anwer_get_templates():
+    """قوالب لوحة التحكم (استيراد Jinja2 مؤجل لتسريع الإقلاع)"""
+    global templates
+    if templates is None:
+        from fastapi.templating import Jinja2Templates
+        templates = Jinja2Templates(directory="anwer_templates")
+    return templates
+
 @app.get("/anwer/{user_id}", response_class=HTMLResponse)
 async def anwer_dashboard(request: Request, user_id: str):
     """لوحة تحكم المستخدم"""
     settings = anwer_load_user_settings(user_id)
-    alerts = anwer_load_user_alerts(user_id)
-
-    # حالة الاتصال
-    connection_status = "غير متصل"
-    if user_id in anwer_clients and anwer_clients[user_id]:
-        if anwer_clients[user_id].is_connected():
-            connection_status = "متصل"
+    alerts, _ = anwer_query_user_alerts(user_id, limit=50)
 
-    # حالة المراقبة
-    monitoring_status = "متوقف"
-    if user_id in anwer_monitoring_tasks and not anwer_monitoring_tasks[user_id].done():
-        monitoring_status = "يعمل"
-
-    return templates.TemplateResponse("anwer_index.html", {
+    return anwer_get_templates().TemplateResponse("anwer_index.html", {
         "request": request,
         "user_id": user_id,
         "settings": settings,
-        "alerts": alerts[:50],  # آخر 50 تنبيه
-        "connection_status": connection_status,
-        "monitoring_status": monitoring_status,
-        "total_alerts": len(alerts)
+        "alerts": alerts,  # آخر 50 تنبيه
+        **anwer_user_status(user_id),
+        "total_alerts": anwer_count_user_alerts(user_id)
     })
 
 @app.post("/anwer/{user_id}/login")
@@ -290,8 +2487,8 @@ async def anwer_login(user_id: str, phone: str = Form(...), api_id: int = Form(D
         anwer_save_user_settings(user_id, settings)
 
         # إنشاء العميل
-        session_file = anwer_users_dir / f"anwer_session_{user_id}_{phone.replace('+', '')}.session"
-        client = TelegramClient(str(session_file), api_id, api_hash)
+        session_file = anwer_session_file(user_id, phone)
+        client = anwer_create_client(session_file, api_id, api_hash)
 
         await client.connect()
 
@@ -301,6 +2498,7 @@ async def anwer_login(user_id: str, phone: str = Form(...), api_id: int = Form(D
             return JSONResponse({"status": "code_required", "message": "تم إرسال رمز التحقق"})
         else:
             anwer_clients[user_id] = client
+            anwer_publish_status(user_id)
             return JSONResponse({"status": "success", "message": "تم تسجيل الدخول بنجاح"})
 
     except Exception as e:
@@ -321,6 +2519,7 @@ async def anwer_verify_code(user_id: str, code: str = Form(...), password: str =
         else:
             await client.sign_in(code=code)
 
+        anwer_publish_status(user_id)
         return JSONResponse({"status": "success", "message": "تم تسجيل الدخول بنجاح"})
 
     except Exception as e:
@@ -338,8 +2537,8 @@ async def anwer_start_monitoring(user_id: str):
             return JSONResponse({"status": "error", "message": "المراقبة تعمل بالفعل"})
 
         # بدء مهمة المراقبة
-        task = asyncio.create_task(anwer_monitor_messages(user_id))
-        anwer_monitoring_tasks[user_id] = task
+        anwer_set_monitoring_enabled(user_id, True)
+        anwer_start_monitoring_task(user_id)
 
         return JSONResponse({"status": "success", "message": "تم بدء المراقبة"})
 
@@ -351,9 +2550,11 @@ async def anwer_start_monitoring(user_id: str):
 async def anwer_stop_monitoring(user_id: str):
     """إيقاف المراقبة"""
     try:
+        anwer_set_monitoring_enabled(user_id, False)
         if user_id in anwer_monitoring_tasks:
             anwer_monitoring_tasks[user_id].cancel()
             del anwer_monitoring_tasks[user_id]
+        anwer_publish_status(user_id)
 
         return JSONResponse({"status": "success", "message": "تم إيقاف المراقبة"})
 
@@ -361,6 +2562,65 @@ async def anwer_stop_monitoring(user_id: str):
         logger.error(f"خطأ في إيقاف المراقبة: {e}")
         return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
 
+@app.post("/anwer/{user_id}/start_auto_send")
+async def anwer_start_auto_send(user_id: str, message: str = Form(None), groups: str = Form(None), interval: int = Form(None)):
+    """بدء الإرسال التلقائي"""
+    try:
+        if user_id not in anwer_clients:
+            return JSONResponse({"status": "error", "message": "يجب تسجيل الدخول أولاً"})
+
+        settings = anwer_load_user_settings(user_id)
+        if message is not None:
+            settings["message"] = message
+        if groups is not None:
+            settings["auto_send_groups"] = [g.strip() for g in groups.split(',') if g.strip()]
+        if interval is not None:
+            settings["auto_send_interval"] = interval
+
+        if not settings.get("message") or not settings.get("auto_send_groups"):
+            return JSONResponse({"status": "error", "message": "يجب تحديد الرسالة والمجموعات"})
+
+        settings["auto_send_enabled"] = True
+        anwer_save_user_settings(user_id, settings)
+        return JSONResponse({"status": "success", "message": "تم بدء الإرسال التلقائي"})
+
+    except Exception as e:
+        logger.error(f"خطأ في بدء الإرسال التلقائي: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
+@app.post("/anwer/{user_id}/stop_auto_send")
+async def anwer_stop_auto_send(user_id: str):
+    """إيقاف الإرسال التلقائي"""
+    try:
+        settings = anwer_load_user_settings(user_id)
+        settings["auto_send_enabled"] = False
+        anwer_save_user_settings(user_id, settings)
+        return JSONResponse({"status": "success", "message": "تم إيقاف الإرسال التلقائي"})
+
+    except Exception as e:
+        logger.error(f"خطأ في إيقاف الإرسال التلقائي: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
+@app.get("/anwer/{user_id}/auto_send_status")
+async def anwer_get_auto_send_status(user_id: str):
+    """حالة الإرسال التلقائي"""
+    try:
+        settings = anwer_load_user_settings(user_id)
+        next_run = anwer_auto_send_next_run.get(user_id)
+        return JSONResponse({
+            "status": "success",
+            "enabled": bool(settings.get("auto_send_enabled")),
+            "interval": anwer_auto_send_interval(settings),
+            "groups": settings.get("auto_send_groups", []),
+            "running": user_id in anwer_auto_send_running,
+            "next_run": datetime.fromtimestamp(next_run).strftime('%Y-%m-%d %H:%M:%S') if next_run else None,
+            "last_result": anwer_auto_send_results.get(user_id)
+        })
+
+    except Exception as e:
+        logger.error(f"خطأ في جلب حالة الإرسال التلقائي: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
 @app.post("/anwer/{user_id}/update_keywords")
 async def anwer_update_keywords(user_id: str, keywords: str = Form(...)):
     """تحديث الكلمات المراقبة"""
@@ -376,97 +2636,505 @@ async def anwer_update_keywords(user_id: str, keywords: str = Form(...)):
         logger.error(f"خطأ في تحديث الكلمات: {e}")
         return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
 
+@app.post("/anwer/{user_id}/update_rules")
+async def anwer_update_rules(user_id: str, exclude_keywords: str = Form(""), whole_word_keywords: str = Form(""),
+                             regex_rules: str = Form(""), chat_allowlist: str = Form(""), chat_denylist: str = Form(""),
+                             sender_blocklist: str = Form(""), min_length: int = Form(0)):
+    """تحديث قواعد التصفية"""
+    try:
+        def split_list(value):
+            return [v.strip() for v in value.split(',') if v.strip()]
+
+        # التعابير النمطية مفصولة بأسطر لأنها قد تحتوي على فواصل
+        patterns = [p.strip() for p in regex_rules.splitlines() if p.strip()]
+        for pattern in patterns:
+            try:
+                anwer_check_regex_rule(pattern)
+            except re.error as e:
+                return JSONResponse({"status": "error", "message": f"تعبير نمطي غير صالح '{pattern}': {e}"})
+
+        settings = anwer_load_user_settings(user_id)
+        settings["rules"] = {
+            "exclude_keywords": split_list(exclude_keywords),
+            "whole_word_keywords": split_list(whole_word_keywords),
+            "regex_rules": patterns,
+            "chat_allowlist": split_list(chat_allowlist),
+            "chat_denylist": split_list(chat_denylist),
+            "sender_blocklist": split_list(sender_blocklist),
+            "min_length": max(0, min_length)
+        }
+
+        anwer_save_user_settings(user_id, settings)
+        return JSONResponse({"status": "success", "message": "تم تحديث قواعد التصفية"})
+
+    except Exception as e:
+        logger.error(f"خطأ في تحديث القواعد: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
 @app.get("/anwer/{user_id}/alerts")
-async def anwer_get_alerts(user_id: str):
-    """الحصول على التنبيهات"""
+async def anwer_get_alerts(request: Request, user_id: str, limit: int = 50, cursor: str = None,
+                           keyword: str = None, chat_id: int = None, sender: str = None,
+                           since: str = None, until: str = None):
+    """الحصول على التنبيهات (الأحدث أولاً، مع التصفية والتصفح بالمؤشر)"""
     try:
-        alerts = anwer_load_user_alerts(user_id)
-        return JSONResponse({"status": "success", "alerts": alerts[:100]})  # آخر 100 تنبيه
+        limit = max(1, min(limit, ANWER_ALERTS_PAGE_MAX))
+
+        # الصفحة تتحدد بالاستعلام وسجل المستخدم، فيُحسب الوسم قبل جلبها (فحص رخيص من الفهرس)
+        etag_source = f"{request.url.query}|{anwer_user_alerts_version(user_id)}"
+        etag = f'"{hashlib.sha1(etag_source.encode()).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        alerts, next_cursor = anwer_query_user_alerts(
+            user_id, limit=limit, cursor=cursor, keyword=keyword, chat_id=chat_id,
+            sender=sender, since=since, until=until
+        )
+
+        return JSONResponse(
+            {"status": "success", "alerts": alerts, "next_cursor": next_cursor},
+            headers={"ETag": etag}
+        )
     except Exception as e:
         logger.error(f"خطأ في جلب التنبيهات: {e}")
         return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
 
+@app.get("/anwer/{user_id}/search")
+async def anwer_search_alerts(user_id: str, q: str = "", limit: int = 50, offset: int = 0):
+    """البحث النصي في كامل سجل التنبيهات (الأكثر صلة أولاً، مع تمييز الكلمات)"""
+    try:
+        limit = max(1, min(limit, ANWER_ALERTS_PAGE_MAX))
+        alerts, terms, next_offset = anwer_search_user_alerts(user_id, q, limit=limit, offset=max(0, offset))
+        for alert in alerts:
+            alert["highlight"] = {
+                "message": anwer_highlight_text(alert["message"], terms, ANWER_SEARCH_SNIPPET_CHARS),
+                "chat_title": anwer_highlight_text(alert["chat_title"], terms),
+                "sender_name": anwer_highlight_text(alert["sender_name"], terms),
+            }
+        return JSONResponse({"status": "success", "alerts": alerts, "terms": terms, "next_offset": next_offset})
+    except Exception as e:
+        logger.error(f"خطأ في البحث في التنبيهات: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
+@app.get("/anwer/{user_id}/stats")
+async def anwer_get_stats(user_id: str, period: str = "day", since: str = None, until: str = None,
+                          dimension: str = None, value: str = None, top: int = 10):
+    """اتجاهات التنبيهات: العدد لكل ساعة/يوم (للكل أو لكلمة/مجموعة/مرسل) وأكثرها تكراراً"""
+    try:
+        stats = anwer_query_user_stats(
+            user_id, period=period, since=since, until=until, dimension=dimension, value=value,
+            top=max(1, min(top, ANWER_STATS_TOP_MAX))
+        )
+        return JSONResponse({"status": "success", **stats})
+    except Exception as e:
+        logger.error(f"خطأ في جلب الإحصائيات: {e}")
+        return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
+
 @app.get("/anwer/{user_id}/status")
 async def anwer_get_status(user_id: str):
     """الحصول على حالة النظام"""
     try:
-        connection_status = "غير متصل"
-        monitoring_status = "متوقف"
-
-        if user_id in anwer_clients and anwer_clients[user_id]:
-            if anwer_clients[user_id].is_connected():
-                connection_status = "متصل"
-
-        if user_id in anwer_monitoring_tasks and not anwer_monitoring_tasks[user_id].done():
-            monitoring_status = "يعمل"
-
+        queue = anwer_alert_queues.get(user_id)
         return JSONResponse({
             "status": "success",
-            "connection_status": connection_status,
-            "monitoring_status": monitoring_status
+            **anwer_user_status(user_id),
+            "dispatch": {**anwer_get_dispatch_stats(user_id).as_dict(), "queue_size": queue.qsize() if queue else 0},
+            "entity_cache": anwer_entity_caches[user_id].stats() if user_id in anwer_entity_caches else {},
+            "health": {key: value for key, value in anwer_client_health.get(user_id, {}).items() if key != "next_check"}
         })
     except Exception as e:
         logger.error(f"خطأ في جلب الحالة: {e}")
         return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
 
-@app.get("/anwer/{user_id}/export")
-async def anwer_export_data(user_id: str):
-    """تصدير البيانات"""
-    try:
-        # إنشاء ملف مؤقت
-        export_file = anwer_users_dir / f"anwer_export_{user_id}_{int(time.time())}.json"
+def anwer_format_sse(event_type, data, event_id=None):
+    """تنسيق حدث بصيغة Server-Sent Events"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/anwer/{user_id}/events")
+async def anwer_stream_events(request: Request, user_id: str, last_id: int = None):
+    """بث التنبيهات الجديدة وتغيّرات الحالة للوحة التحكم (SSE)"""
+    # المتصفح يرسل Last-Event-ID تلقائياً عند إعادة الاتصال
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        last_id = int(last_event_id)
+
+    # الاشتراك قبل قراءة التنبيهات الفائتة حتى لا يضيع شيء بينهما
+    queue = asyncio.Queue(maxsize=ANWER_EVENT_QUEUE_SIZE)
+    anwer_event_subscribers.setdefault(user_id, set()).add(queue)
+
+    async def anwer_event_stream():
+        sent_id = last_id
+        try:
+            if sent_id is None:
+                # أول اتصال: البدء من آخر تنبيه موجود
+                rows = anwer_query_alerts("SELECT MAX(id) FROM alerts WHERE user_id = ?", (user_id,))
+                sent_id = rows[0][0] or 0
+                yield anwer_format_sse("status", anwer_user_status(user_id), sent_id)
+            else:
+                yield anwer_format_sse("status", anwer_user_status(user_id))
+                rows = anwer_query_alerts(
+                    "SELECT * FROM alerts WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user_id, sent_id, ANWER_EVENT_RESUME_LIMIT)
+                )
+                for row in rows:
+                    sent_id = row["id"]
+                    yield anwer_format_sse("alert", anwer_alert_from_row(row), sent_id)
+
+            while queue in anwer_event_subscribers.get(user_id, ()):
+                try:
+                    event_type, data, event_id = await asyncio.wait_for(queue.get(), timeout=ANWER_EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event_id is not None:
+                    if event_id <= sent_id:
+                        continue
+                    sent_id = event_id
+                yield anwer_format_sse(event_type, data, event_id)
+        finally:
+            subscribers = anwer_event_subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del anwer_event_subscribers[user_id]
+
+    return StreamingResponse(anwer_event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+ANWER_EXPORT_FORMATS = {
+    "json": ("application/json", "json"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "csv": ("text/csv; charset=utf-8", "csv")
+}
+
+def anwer_iter_user_alerts(user_id, chunk_size=ANWER_EXPORT_CHUNK_SIZE):
+    """قراءة تنبيهات المستخدم على دفعات من الأقدم للأحدث"""
+    last_id = 0
+    while True:
+        rows = anwer_query_alerts(
+            "SELECT * FROM alerts WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (user_id, last_id, chunk_size)
+        )
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield [anwer_alert_from_row(row) for row in rows]
 
-        data = {
+async def anwer_export_chunks(user_id, export_format):
+    """توليد ملف التصدير كنص على دفعات"""
+    if export_format == "json":
+        header = {
             "settings": anwer_load_user_settings(user_id),
-            "alerts": anwer_load_user_alerts(user_id),
             "export_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
+        yield json.dumps(header, ensure_ascii=False)[:-1] + ', "alerts": ['
+    elif export_format == "csv":
+        # علامة BOM حتى يعرض Excel النص العربي بشكل صحيح
+        yield "\ufeff"
+
+    first = True
+    for alerts in anwer_iter_user_alerts(user_id):
+        buffer = io.StringIO()
+        if export_format == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=("id",) + ANWER_ALERT_COLUMNS, extrasaction='ignore')
+            if first:
+                writer.writeheader()
+            for alert in alerts:
+                writer.writerow({**alert, "keywords": "، ".join(alert["keywords"])})
+        else:
+            for alert in alerts:
+                if export_format == "json" and not first:
+                    buffer.write(",")
+                buffer.write(json.dumps(alert, ensure_ascii=False))
+                if export_format == "jsonl":
+                    buffer.write("\n")
+                first = False
+        first = False
+        yield buffer.getvalue()
+        await asyncio.sleep(0)
+
+    if export_format == "json":
+        yield "]}"
+
+async def anwer_encode_export(chunks, compress):
+    """ترميز أجزاء التصدير وضغطها بـ gzip عند الطلب"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    async for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
 
-        with open(export_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-
-        return FileResponse(
-            path=export_file,
-            filename=f"anwer_export_{user_id}.json",
-            media_type="application/json"
+@app.get("/anwer/{user_id}/export")
+async def anwer_export_data(user_id: str, format: str = "json", compress: bool = False):
+    """تصدير البيانات (بث مباشر من قاعدة البيانات دون ملفات مؤقتة)"""
+    try:
+        if format not in ANWER_EXPORT_FORMATS:
+            return JSONResponse({"status": "error", "message": f"صيغة غير مدعومة: {format}"})
+
+        media_type, extension = ANWER_EXPORT_FORMATS[format]
+        filename = f"anwer_export_{user_id}.{extension}"
+        if compress:
+            media_type = "application/gzip"
+            filename += ".gz"
+
+        return StreamingResponse(
+            anwer_encode_export(anwer_export_chunks(user_id, format), compress),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
 
     except Exception as e:
         logger.error(f"خطأ في تصدير البيانات: {e}")
         return JSONResponse({"status": "error", "message": f"خطأ: {str(e)}"})
 
+def anwer_liveness():
+    """مهام الخلفية الدائمة المتوقفة (القائمة الفارغة تعني أن الخدمة حية)"""
+    return [name for name, task in anwer_background_tasks.items() if task.done()]
+
+def anwer_service_status():
+    """ملخص حالة الخدمة من العملاء ومهام المراقبة الفعلية"""
+    clients = [client for client in list(anwer_clients.values()) if client]
+    running = {user_id for user_id, task in list(anwer_monitoring_tasks.items()) if not task.done()}
+    failed_tasks = anwer_liveness()
+    ready = anwer_readiness["stage"] == "ready"
+
+    return {
+        "alive": not failed_tasks,
+        "ready": ready and not failed_tasks,
+        "failed_tasks": failed_tasks,
+        "readiness": dict(anwer_readiness),
+        "uptime_seconds": int(time.time() - anwer_started_at),
+        "clients": {
+            "total": len(clients),
+            "connected": sum(1 for client in clients if client.is_connected()),
+            "unhealthy": sum(1 for health in list(anwer_client_health.values()) if health["ok"] is False)
+        },
+        "monitoring": {
+            "running": len(running),
+            "enabled": len(anwer_monitoring_enabled),
+            # مراقبة مطلوبة لكنها متوقفة (بانتظار إعادة الاتصال مثلاً)
+            "stalled": len(anwer_monitoring_enabled - running) if ready else 0
+        },
+        "auto_send_scheduled": len(anwer_auto_send_next_run),
+        "alert_write_buffer": len(anwer_alert_write_buffer)
+    }
+
+@app.get("/health")
+async def anwer_health():
+    """حياة الخدمة: 503 إذا توقفت إحدى مهام الخلفية الدائمة"""
+    failed_tasks = anwer_liveness()
+    if failed_tasks:
+        return JSONResponse({"status": "error", "failed_tasks": failed_tasks}, status_code=503)
+    return JSONResponse({"status": "ok"})
+
+@app.get("/ready")
+async def anwer_ready():
+    """جاهزية الخدمة: 503 حتى تنتهي استعادة الجلسات"""
+    ready = anwer_readiness["stage"] == "ready" and not anwer_liveness()
+    return JSONResponse({"status": "ok" if ready else "starting", **anwer_readiness}, status_code=200 if ready else 503)
+
+@app.get("/status")
+async def anwer_service_status_json():
+    """حالة الخدمة بصيغة JSON"""
+    return JSONResponse({"status": "success", **anwer_service_status()})
+
+@app.get("/", response_class=HTMLResponse)
+async def anwer_status_page():
+    """صفحة حالة السيرفر (لـ UptimeRobot والمتابعة السريعة)"""
+    return anwer_render_status_page(anwer_service_status())
+
+# عدادات الطابور المعروضة في /metrics: (اسم المقياس، مفتاح العداد، الوصف)
+ANWER_DISPATCH_METRICS = (
+    ("anwer_alerts_enqueued_total", "enqueued", "Matches queued for notification"),
+    ("anwer_alerts_sent_total", "sent", "Matches delivered to the notifications chat"),
+    ("anwer_alerts_batched_total", "batched", "Matches delivered inside a batched notification"),
+    ("anwer_alerts_dropped_total", "dropped", "Matches dropped because the dispatch queue was full"),
+    ("anwer_alerts_suppressed_total", "suppressed", "Matches suppressed as duplicates"),
+    ("anwer_messages_caught_up_total", "caught_up", "Missed messages scanned after a reconnect or restart"),
+    ("anwer_catch_up_truncated_chats_total", "catch_up_truncated", "Chats whose catch-up stopped at max_gap messages"),
+    ("anwer_notification_failures_total", "failed", "Matches whose notification could not be sent"),
+    ("anwer_flood_waits_total", "flood_waits", "FloodWait errors while sending notifications"),
+    ("anwer_flood_wait_seconds_total", "flood_wait_seconds", "Seconds requested by FloodWait errors")
+)
+
+def anwer_metric_labels(labels):
+    """تنسيق التسميات بصيغة Prometheus (مع عنونة العامل في وضع العمال المتعددين)"""
+    if ANWER_SHARD_COUNT > 1:
+        labels = {**labels, "shard": ANWER_SHARD_INDEX}
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+def anwer_render_metrics():
+    """تكوين نص المقاييس بصيغة Prometheus"""
+    lines = []
+
+    def family(name, metric_type, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{anwer_metric_labels(labels)} {value}")
+
+    def histogram(name, description, hist):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for bound, count in hist.samples():
+            lines.append(f"{name}_bucket{anwer_metric_labels({'le': bound})} {count}")
+        lines.append(f"{name}_sum{anwer_metric_labels({})} {hist.sum}")
+        lines.append(f"{name}_count{anwer_metric_labels({})} {hist.count}")
+
+    message_metrics = list(anwer_message_metrics.items())
+    family("anwer_messages_seen_total", "counter", "Group messages received by the monitor",
+           [({"user_id": user_id}, metrics.seen) for user_id, metrics in message_metrics])
+    family("anwer_messages_matched_total", "counter", "Group messages that matched the user's rules",
+           [({"user_id": user_id}, metrics.matched) for user_id, metrics in message_metrics])
+
+    dispatch_stats = list(anwer_dispatch_stats.items())
+    for name, key, description in ANWER_DISPATCH_METRICS:
+        family(name, "counter", description,
+               [({"user_id": user_id}, getattr(stats, key)) for user_id, stats in dispatch_stats])
+
+    family("anwer_shared_matches_total", "counter", "Messages scanned by the shared matcher, or reused from another account",
+           [({"result": "computed"}, anwer_shared_matcher.computed), ({"result": "reused"}, anwer_shared_matcher.reused)])
+    family("anwer_shared_index_rebuilds_total", "counter", "Background rebuilds of the shared keyword index",
+           [({}, anwer_shared_matcher.rebuilds)])
+
+    histogram("anwer_match_latency_seconds", "Time spent evaluating rules for one message", anwer_match_latency)
+    histogram("anwer_notification_send_seconds", "Time spent sending one notification", anwer_notification_latency)
+    histogram("anwer_alert_write_seconds", "Time spent writing one batch to the alert store", anwer_alert_write_latency)
+
+    family("anwer_alert_queue_depth", "gauge", "Matches waiting in the dispatch queue",
+           [({"user_id": user_id}, queue.qsize()) for user_id, queue in list(anwer_alert_queues.items())])
+    family("anwer_alert_write_buffer_size", "gauge", "Alerts waiting to be written to the alert store",
+           [({}, len(anwer_alert_write_buffer))])
+    family("anwer_event_subscribers", "gauge", "Open dashboard event streams",
+           [({}, sum(len(queues) for queues in list(anwer_event_subscribers.values())))])
+    family("anwer_clients_connected", "gauge", "Telegram clients currently connected",
+           [({}, sum(1 for client in list(anwer_clients.values()) if client and client.is_connected()))])
+    family("anwer_clients_monitoring", "gauge", "Users with a running monitoring task",
+           [({}, sum(1 for task in list(anwer_monitoring_tasks.values()) if not task.done()))])
+    family("anwer_ready", "gauge", "1 once persisted sessions have been restored",
+           [({}, int(anwer_readiness["stage"] == "ready"))])
+
+    return "\n".join(lines) + "\n"
+
+@app.get("/metrics")
+async def anwer_metrics():
+    """مقاييس خط المراقبة بصيغة Prometheus"""
+    return Response(anwer_render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def anwer_update_shard_membership(request: Request):
+    """تحديث قائمة العمال الأحياء (من الواجهة الأمامية في وضع العمال المتعددين)"""
+    token = request.headers.get("X-Anwer-Shard-Token", "")
+    if not ANWER_SHARD_TOKEN or not hmac.compare_digest(token, ANWER_SHARD_TOKEN):
+        return JSONResponse({"status": "error", "message": "غير مصرح"}, status_code=403)
+
+    try:
+        alive = (await request.json())["alive"]
+    except (ValueError, TypeError, KeyError):
+        alive = None
+    if (not isinstance(alive, list) or ANWER_SHARD_INDEX not in alive
+            or not all(type(shard_index) is int and 0 <= shard_index < ANWER_SHARD_COUNT for shard_index in alive)):
+        return JSONResponse({"status": "error", "message": "قائمة عمال غير صالحة"}, status_code=400)
+
+    anwer_shard_alive[:] = sorted(set(alive))
+    logger.info(f"🧩 العامل {ANWER_SHARD_INDEX}: العمال الأحياء {anwer_shard_alive}")
+
+    # استعادة جلسات المستخدمين الذين انتقلوا لهذا العامل ومواعيد إرسالهم التلقائي
+    asyncio.create_task(anwer_restore_sessions())
+    anwer_restore_auto_send_schedule()
+    return JSONResponse({"status": "success"})
+
+# المسار الداخلي موجود فقط في عمال anwer_shards (خلف الواجهة الأمامية التي لا تمرّره)
+if ANWER_SHARD_COUNT > 1:
+    app.post("/anwer_internal/shards")(anwer_update_shard_membership)
+
 async def anwer_cleanup_on_shutdown():
-    """تنظيف الموارد عند الإغلاق"""
+    """إغلاق منظم: إيقاف استقبال الرسائل، تفريغ الطوابير، حفظ نقطة الاستئناف، ثم قطع الاتصالات"""
+    global anwer_shutting_down, anwer_alerts_db
+    anwer_shutting_down = True
+    anwer_readiness["stage"] = "shutting_down"
+    deadline = time.monotonic() + ANWER_SHUTDOWN_TIMEOUT
+    logger.info("🛑 بدء الإغلاق المنظم...")
+
     try:
-        # إيقاف جميع مهام المراقبة
-        for task in anwer_monitoring_tasks.values():
+        # نقطة الاستئناف أولاً حتى لا تضيع إذا تجاوز الإغلاق المهلة
+        anwer_save_monitoring_state()
+
+        # إرسال التنبيهات المتبقية في الطوابير (العملاء ما زالوا متصلين)
+        queues = list(anwer_alert_queues.values())
+        if queues:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in queues)),
+                    timeout=max(deadline - time.monotonic() - ANWER_SHUTDOWN_DISCONNECT_TIMEOUT, 0)
+                )
+            except asyncio.TimeoutError:
+                remaining = sum(queue.qsize() for queue in queues)
+                logger.warning(f"⚠️ انتهت مهلة تفريغ الطوابير، لم يُرسل {remaining} تنبيه")
+
+        # ملخصات الرسائل المكررة التي لم تنتهِ نوافذها بعد، وإلا ضاعت مع الذاكرة
+        summaries = [
+            anwer_send_dedup_summaries(user_id, client, everything=True)
+            for user_id, client in anwer_clients.items()
+            if client and client.is_connected() and user_id in anwer_dedup_windows
+        ]
+        if summaries:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*summaries, return_exceptions=True),
+                    timeout=max(deadline - time.monotonic() - ANWER_SHUTDOWN_DISCONNECT_TIMEOUT, 0)
+                )
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ انتهت مهلة إرسال ملخصات الرسائل المكررة")
+
+        # كتابة التنبيهات المؤجلة ومواضع المحادثات
+        anwer_flush_alerts()
+        anwer_save_chat_positions()
+
+        # قطع اتصال جميع العملاء بالتوازي (يحفظ تليجرام ملف الجلسة عند قطع الاتصال)
+        clients = [client for client in anwer_clients.values() if client and client.is_connected()]
+        if clients:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True),
+                    timeout=max(deadline - time.monotonic(), 1)
+                )
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ انتهت مهلة قطع اتصال العملاء")
+
+        # إيقاف ما تبقى من مهام المراقبة وعمال الإرسال
+        for task in [*anwer_monitoring_tasks.values(), *anwer_dispatch_workers.values()]:
             if not task.done():
                 task.cancel()
 
-        # قطع اتصال جميع العملاء
-        for client in anwer_clients.values():
-            if client and client.is_connected():
-                await client.disconnect()
+        with anwer_alerts_db_lock:
+            if anwer_alerts_db is not None:
+                anwer_alerts_db.close()
+                anwer_alerts_db = None
 
         logger.info("✅ تم تنظيف جميع الموارد")
     except Exception as e:
         logger.error(f"خطأ في التنظيف: {e}")
 
 if __name__ == "__main__":
-    # بدء مراقبة صحة الاتصالات
-    asyncio.create_task(anwer_monitor_connection_health())
-
-    # معالجة إشارة الإغلاق
-    def signal_handler(signum, frame):
-        logger.info("🛑 تم استلام إشارة الإغلاق...")
-        asyncio.create_task(anwer_cleanup_on_shutdown())
-
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
-    # بدء السيرفر
-    keep_alive()
+    # بدء السيرفر (الإغلاق المنظم يتم في anwer_lifespan عند SIGTERM/SIGINT)
     try:
-        uvicorn.run(app, host="0.0.0.0", port=4000)
+        uvicorn.run(app, host="0.0.0.0", port=4000, timeout_graceful_shutdown=ANWER_HTTP_SHUTDOWN_TIMEOUT)
     except Exception as e:
         logger.error(f"خطأ في تشغيل السيرفر: {e}")
\ No newline at end of file
@@ -0,0 +1,430 @@
+"""واجهة تيليجرام وهمية داخل العملية لاختبارات التحميل والتكامل دون شبكة
+
+خادم وهمي (محادثات ومرسلون ورسائل وحسابات) وعميل بنفس دوال TelegramClient التي يستخدمها Anwer،
+مع فيضانات رسائل بمعدل محدد، وأخطاء FloodWait، وانقطاع الاتصال، وقوائم محادثات كبيرة.
+يُفعَّل في التطبيق عبر مصنع العملاء:
+
+    ANWER_CLIENT_FACTORY=anwer_fake_telegram:anwer_fake_client_factory python run.py
+
+رمز التحقق عند تسجيل الدخول هو ANWER_FAKE_LOGIN_CODE (الافتراضي 12345). ويمكن تشغيل المسار كاملاً
+(تسجيل الدخول ← المراقبة ← التنبيهات) تحت الضغط مباشرة:
+
+    python anwer_fake_telegram.py --users 20 --messages 50000 --rate 5000 --disconnect-every 10000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from telethon import events
+from telethon.errors import (
+    AuthKeyUnregisteredError, FloodWaitError, PasswordHashInvalidError, PhoneCodeInvalidError,
+    SessionPasswordNeededError
+)
+from telethon.tl.types import User
+
+logger = logging.getLogger(__name__)
+
+# إعدادات الخادم الوهمي الافتراضي (من البيئة حتى تصل أيضاً لعمال ANWER_WORKERS)
+ANWER_FAKE_LOGIN_CODE = os.environ.get("ANWER_FAKE_LOGIN_CODE", "12345")
+ANWER_FAKE_PASSWORD = os.environ.get("ANWER_FAKE_PASSWORD") or None
+ANWER_FAKE_DIALOGS = int(os.environ.get("ANWER_FAKE_DIALOGS", 50))
+ANWER_FAKE_SENDERS = int(os.environ.get("ANWER_FAKE_SENDERS", 200))
+ANWER_FAKE_FLOOD_WAIT_RATE = float(os.environ.get("ANWER_FAKE_FLOOD_WAIT_RATE", 0))
+ANWER_FAKE_FLOOD_WAIT_SECONDS = int(os.environ.get("ANWER_FAKE_FLOOD_WAIT_SECONDS", 1))
+ANWER_FAKE_SEND_LATENCY = float(os.environ.get("ANWER_FAKE_SEND_LATENCY_MS", 0)) / 1000
+
+# عدد الرسائل المحفوظة لكل محادثة (لجلب الرسائل الفائتة بعد الانقطاع)، وحجم صفحة قائمة المحادثات
+ANWER_FAKE_HISTORY_SIZE = 1000
+ANWER_FAKE_DIALOGS_PAGE = 100
+
+class AnwerFakeChat:
+    """مجموعة أو قناة: megagroup (الافتراضي)، channel، أو group (مجموعة عادية)"""
+
+    def __init__(self, chat_id, title, username=None, kind="megagroup"):
+        self.id = chat_id
+        self.title = title
+        self.username = username
+        self.kind = kind
+        self.is_group = kind != "channel"
+        self.is_channel = kind != "group"
+        # المعرّف المعلّم كما يظهر في chat_id للرسائل (-100... للقنوات والمجموعات الكبيرة)
+        self.marked_id = -(1000000000000 + chat_id) if self.is_channel else -chat_id
+
+class AnwerFakeMessage:
+    """رسالة بنفس الخصائص التي يقرؤها Anwer من telethon Message"""
+
+    def __init__(self, message_id, chat, sender, text):
+        self.id = message_id
+        self.chat_id = chat.marked_id
+        self.sender_id = sender.id
+        self.sender = sender
+        self.message = text
+        self.is_group = chat.is_group
+        self.is_channel = chat.is_channel
+        self.date = datetime.now()
+        self._chat = chat
+
+    async def get_sender(self):
+        return self.sender
+
+    async def get_chat(self):
+        return self._chat
+
+class AnwerFakeTelegram:
+    """خادم تيليجرام وهمي مشترك بين العملاء، مع أعطال قابلة للضبط"""
+
+    def __init__(self, dialogs=ANWER_FAKE_DIALOGS, senders=ANWER_FAKE_SENDERS, login_code=ANWER_FAKE_LOGIN_CODE,
+                 password=ANWER_FAKE_PASSWORD, flood_wait_rate=ANWER_FAKE_FLOOD_WAIT_RATE,
+                 flood_wait_seconds=ANWER_FAKE_FLOOD_WAIT_SECONDS, send_latency=ANWER_FAKE_SEND_LATENCY, seed=None):
+        self.rng = random.Random(seed)
+        self.login_code = login_code
+        self.password = password
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.send_latency = send_latency
+        self.chats = []
+        self.histories = {}
+        self.senders = [
+            SimpleNamespace(id=5000000 + i, first_name=f"user{i}", last_name="", username=f"user{i}")
+            for i in range(senders)
+        ]
+        self.clients = set()
+        self.revoked = set()
+        self.offline = False
+        self.stats = {"posted": 0, "delivered": 0, "sent": 0, "flood_waits": 0, "disconnects": 0}
+        self.add_chats(dialogs)
+
+    def add_chats(self, count, kind="megagroup"):
+        """إضافة محادثات يشترك فيها جميع الحسابات (لقوائم محادثات كبيرة)"""
+        added = []
+        for _ in range(count):
+            index = len(self.chats)
+            chat = AnwerFakeChat(1000000 + index, f"مجموعة {index}", f"fakegroup{index}", kind)
+            self.chats.append(chat)
+            self.histories[chat.marked_id] = deque(maxlen=ANWER_FAKE_HISTORY_SIZE)
+            added.append(chat)
+        return added
+
+    def last_message(self, chat):
+        history = self.histories[chat.marked_id]
+        return history[-1] if history else None
+
+    async def post(self, chat, text, sender=None):
+        """نشر رسالة في محادثة وتسليمها فوراً لكل عميل متصل"""
+        history = self.histories[chat.marked_id]
+        message_id = history[-1].id + 1 if history else 1
+        message = AnwerFakeMessage(message_id, chat, sender or self.rng.choice(self.senders), text)
+        history.append(message)
+        self.stats["posted"] += 1
+
+        for client in list(self.clients):
+            if client.is_connected():
+                self.stats["delivered"] += 1
+                await client.dispatch(message)
+        return message
+
+    async def flood(self, count, rate=None, text_factory=None, chats=None, disconnect_every=0):
+        """نشر عدد من الرسائل بمعدل محدد (رسالة/ثانية، بلا حد إذا لم يُحدد) مع انقطاع دوري اختياري"""
+        chats = chats or self.chats
+        text_factory = text_factory or (lambda rng: f"رسالة تجريبية {rng.random()}")
+        started_at = time.perf_counter()
+        for i in range(count):
+            if rate:
+                # الالتزام بالجدول الزمني دون تراكم التأخير (النوم فقط عند السبق)
+                ahead = started_at + i / rate - time.perf_counter()
+                if ahead > 0.001:
+                    await asyncio.sleep(ahead)
+            if disconnect_every and i and i % disconnect_every == 0:
+                self.disconnect_all()
+            await self.post(chats[i % len(chats)], text_factory(self.rng))
+            if i % 100 == 99:
+                # إتاحة الفرصة لعمال الإرسال والمهام الخلفية كما بين تحديثات تليجرام الحقيقية
+                await asyncio.sleep(0)
+        return time.perf_counter() - started_at
+
+    def disconnect_all(self):
+        """قطع اتصال جميع العملاء كما يحدث عند انقطاع الشبكة"""
+        for client in list(self.clients):
+            client.drop()
+        self.stats["disconnects"] += 1
+
+    def revoke(self, phone):
+        """إلغاء جلسة رقم من "تيليجرام" (AuthKeyUnregisteredError في الطلب التالي)"""
+        self.revoked.add(phone)
+
+class AnwerFakeClient:
+    """بديل TelegramClient بالدوال التي يستخدمها Anwer، متصل بالخادم الوهمي"""
+
+    def __init__(self, session, api_id, api_hash, backend):
+        self.session_file = Path(session if str(session).endswith(".session") else f"{session}.session")
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.backend = backend
+        self.handlers = []
+        self.sent = deque(maxlen=ANWER_FAKE_HISTORY_SIZE)
+        self._phone = None
+        self._session_data = None
+        self._connected = False
+        self._disconnected = asyncio.Event()
+
+    def _session(self):
+        """بيانات الجلسة المحفوظة (تبقى بعد إعادة التشغيل مثل ملف جلسة telethon)"""
+        if self._session_data is None:
+            try:
+                self._session_data = json.loads(self.session_file.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                self._session_data = {}
+        return self._session_data
+
+    def _require_connection(self):
+        if not self._connected:
+            raise ConnectionError("Cannot send requests while disconnected")
+        if self._session().get("phone") in self.backend.revoked:
+            raise AuthKeyUnregisteredError(request=None)
+
+    async def connect(self):
+        if self.backend.offline:
+            raise ConnectionError("Connection to Telegram failed")
+        self._connected = True
+        self._disconnected = asyncio.Event()
+        self.backend.clients.add(self)
+
+    def drop(self):
+        """انقطاع مفاجئ من جهة الشبكة"""
+        self._connected = False
+        self._disconnected.set()
+        self.backend.clients.discard(self)
+
+    async def disconnect(self):
+        self.drop()
+
+    def is_connected(self):
+        return self._connected
+
+    async def run_until_disconnected(self):
+        await self._disconnected.wait()
+
+    async def is_user_authorized(self):
+        self._require_connection()
+        return bool(self._session().get("authorized"))
+
+    async def send_code_request(self, phone):
+        self._require_connection()
+        self._phone = phone
+        return SimpleNamespace(phone_code_hash="fake", type=None)
+
+    async def sign_in(self, phone=None, code=None, password=None):
+        self._require_connection()
+        if password is not None:
+            if self.backend.password is not None and password != self.backend.password:
+                raise PasswordHashInvalidError(request=None)
+        elif str(code) != str(self.backend.login_code):
+            raise PhoneCodeInvalidError(request=None)
+        elif self.backend.password is not None:
+            raise SessionPasswordNeededError(request=None)
+
+        self._session_data = {"phone": phone or self._phone, "authorized": True}
+        self.session_file.write_text(json.dumps(self._session_data), encoding='utf-8')
+        return await self.get_me()
+
+    async def get_me(self):
+        self._require_connection()
+        phone = (self._session().get("phone") or self._phone or "").lstrip('+')
+        user_id = 7000000000 + int(phone[-9:] or 0) if phone.isdigit() else 7000000000
+        return User(id=user_id, is_self=True, access_hash=0, first_name="Anwer", username=f"anwer{phone}")
+
+    async def iter_dialogs(self):
+        """قائمة المحادثات على صفحات مثل telethon (الأحدث نشاطاً أولاً)"""
+        self._require_connection()
+        dialogs = [(chat, self.backend.last_message(chat)) for chat in self.backend.chats]
+        dialogs.sort(key=lambda dialog: dialog[1].date if dialog[1] else datetime.min, reverse=True)
+        for index, (chat, last_message) in enumerate(dialogs):
+            if index % ANWER_FAKE_DIALOGS_PAGE == 0:
+                await asyncio.sleep(0)
+            yield SimpleNamespace(
+                id=chat.marked_id, name=chat.title, title=chat.title, entity=chat,
+                message=last_message, is_user=False,
+                is_group=chat.is_group, is_channel=chat.is_channel
+            )
+
+    async def iter_messages(self, entity, limit=None, min_id=0, reverse=False):
+        """رسائل محادثة بعد min_id من السجل المحفوظ"""
+        self._require_connection()
+        messages = [message for message in self.backend.histories[entity.marked_id] if message.id > min_id]
+        if not reverse:
+            messages.reverse()
+        for message in messages[:limit]:
+            yield message
+
+    async def send_message(self, entity, message):
+        self._require_connection()
+        if self.backend.send_latency:
+            await asyncio.sleep(self.backend.send_latency)
+        if self.backend.flood_wait_rate and self.backend.rng.random() < self.backend.flood_wait_rate:
+            self.backend.stats["flood_waits"] += 1
+            raise FloodWaitError(request=None, capture=self.backend.flood_wait_seconds)
+        self.backend.stats["sent"] += 1
+        self.sent.append((entity, message))
+        return SimpleNamespace(id=self.backend.stats["sent"], message=message)
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        before = len(self.handlers)
+        self.handlers = [(c, e) for c, e in self.handlers if c is not callback or (event is not None and e is not event)]
+        return before - len(self.handlers)
+
+    async def dispatch(self, message):
+        """تسليم رسالة جديدة لمعالجات NewMessage المسجّلة"""
+        for callback, event in list(self.handlers):
+            if event is events.NewMessage or isinstance(event, events.NewMessage):
+                await callback(SimpleNamespace(message=message))
+
+# الخادم الوهمي المشترك لكل العملاء التي ينشئها المصنع داخل العملية
+anwer_fake_backend = None
+
+def anwer_get_fake_backend():
+    """الخادم الوهمي المشترك (يُنشأ عند أول عميل)"""
+    global anwer_fake_backend
+    if anwer_fake_backend is None:
+        anwer_fake_backend = AnwerFakeTelegram()
+    return anwer_fake_backend
+
+def anwer_fake_client_factory(session, api_id, api_hash):
+    """مصنع عملاء لـ ANWER_CLIENT_FACTORY يتصل بالخادم الوهمي بدلاً من تيليجرام"""
+    return AnwerFakeClient(session, api_id, api_hash, anwer_get_fake_backend())
+
+async def anwer_fake_load(bot, backend, params):
+    """تشغيل التطبيق كاملاً على الخادم الوهمي: تسجيل الدخول ثم المراقبة ثم فيضان رسائل"""
+    from anwer_bench import anwer_bench_keywords, anwer_bench_message
+
+    rng = random.Random(params["seed"])
+    user_ids = [f"load-{i}" for i in range(params["users"])]
+    keyword_sets = []
+
+    async with bot.anwer_lifespan(bot.app):
+        for index, user_id in enumerate(user_ids):
+            settings = bot.anwer_load_user_settings(user_id)
+            settings["keywords"] = anwer_bench_keywords(rng, params["corpus"], params["keywords"])
+            bot.anwer_save_user_settings(user_id, settings)
+            keyword_sets.append(settings["keywords"])
+
+            phone = f"+96770{index:07d}"
+            await bot.anwer_login(user_id, phone=phone, api_id=1, api_hash="fake")
+            result = await bot.anwer_verify_code(user_id, code=backend.login_code, password=backend.password or "")
+            if json.loads(result.body)["status"] != "success":
+                raise RuntimeError(f"فشل تسجيل الدخول الوهمي للمستخدم {user_id}: {result.body.decode()}")
+            await bot.anwer_start_monitoring(user_id)
+        await asyncio.sleep(0)
+
+        def text_factory(text_rng):
+            keywords = text_rng.choice(keyword_sets)
+            keyword = text_rng.choice(keywords) if text_rng.random() < params["match_ratio"] else None
+            return anwer_bench_message(text_rng, params["corpus"], keyword)
+
+        elapsed = await backend.flood(
+            params["messages"], rate=params["rate"], text_factory=text_factory,
+            disconnect_every=params["disconnect_every"]
+        )
+
+        # انتظار إعادة الاتصال (بعد آخر انقطاع) وانتهاء جلب الفائت وتفريغ طوابير التنبيهات
+        deadline = time.monotonic() + params["settle_timeout"]
+        while time.monotonic() < deadline:
+            running = [
+                bot.anwer_clients[user_id].is_connected() and not bot.anwer_monitoring_tasks[user_id].done()
+                for user_id in user_ids
+            ]
+            if all(running):
+                break
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(params["settle"])
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(bot.anwer_alert_queues[user_id].join() for user_id in user_ids)),
+                timeout=max(deadline - time.monotonic(), 0.1)
+            )
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ انتهت المهلة قبل إرسال كل التنبيهات")
+        bot.anwer_flush_alerts()
+
+        result = {
+            "users": len(user_ids),
+            "messages": params["messages"],
+            "elapsed_s": round(elapsed, 3),
+            "messages_per_s": round(params["messages"] / elapsed, 1),
+            "deliveries_per_s": round(backend.stats["delivered"] / elapsed, 1),
+            **backend.stats,
+            "matched": sum(bot.anwer_message_metrics[user_id].matched for user_id in user_ids),
+            "alerts_saved": sum(bot.anwer_count_user_alerts(user_id) for user_id in user_ids),
+        }
+        for key in ("sent", "batched", "dropped", "suppressed", "failed", "caught_up", "catch_up_truncated"):
+            result[f"dispatch_{key}"] = sum(getattr(bot.anwer_get_dispatch_stats(user_id), key) for user_id in user_ids)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="تشغيل Anwer تحت الضغط على خادم تيليجرام وهمي")
+    parser.add_argument("--users", type=int, default=10, help="عدد الحسابات (كلها مشتركة في كل المحادثات)")
+    parser.add_argument("--dialogs", type=int, default=ANWER_FAKE_DIALOGS, help="عدد المحادثات")
+    parser.add_argument("--keywords", type=int, default=100, help="عدد الكلمات المراقبة لكل حساب")
+    parser.add_argument("--corpus", choices=("arabic", "english"), default="arabic")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=0, help="رسالة/ثانية (0 = بأقصى سرعة)")
+    parser.add_argument("--match-ratio", type=float, default=0.02)
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0, help="نسبة طلبات الإرسال التي ترد بـ FloodWait")
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument("--send-latency-ms", type=float, default=0.0)
+    parser.add_argument("--disconnect-every", type=int, default=0, help="قطع اتصال جميع الحسابات كل N رسالة")
+    parser.add_argument("--notify-rate", type=float, default=1000.0,
+                        help="حد الإرسال لكل حساب (رسالة/ثانية)؛ الحد الحقيقي يبطئ التفريغ لا المعالجة")
+    parser.add_argument("--settle", type=float, default=0.5, help="ثوانٍ إضافية بعد تفريغ الطوابير")
+    parser.add_argument("--settle-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    backend = AnwerFakeTelegram(
+        dialogs=args.dialogs, flood_wait_rate=args.flood_wait_rate, flood_wait_seconds=args.flood_wait_seconds,
+        send_latency=args.send_latency_ms / 1000, seed=args.seed
+    )
+    global anwer_fake_backend
+    anwer_fake_backend = backend
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(prefix="anwer_fake_") as workdir:
+        os.chdir(workdir)
+        sys.path.insert(0, repo_dir)
+        os.environ["ANWER_CLIENT_FACTORY"] = "anwer_fake_telegram:anwer_fake_client_factory"
+        # هذا الملف يعمل كـ __main__، فالمصنع يجب أن يرى نفس الخادم عند استيراده باسم الوحدة
+        sys.modules.setdefault("anwer_fake_telegram", sys.modules[__name__])
+        import anwer_bot
+        logging.disable(logging.WARNING)
+
+        # فحص الاتصال وإعادة المحاولة بسرعة حتى تعود الحسابات بعد الانقطاع أثناء التشغيل
+        anwer_bot.ANWER_NOTIFY_RATE = args.notify_rate
+        anwer_bot.ANWER_NOTIFY_BURST = max(anwer_bot.ANWER_NOTIFY_BURST, int(args.notify_rate))
+        anwer_bot.ANWER_HEALTH_TICK = 0.1
+        anwer_bot.ANWER_HEALTH_CHECK_INTERVAL = 0.2
+        anwer_bot.ANWER_RECONNECT_BASE_DELAY = 0.1
+
+        result = asyncio.run(anwer_fake_load(anwer_bot, backend, {
+            "users": args.users, "keywords": args.keywords, "corpus": args.corpus, "messages": args.messages,
+            "rate": args.rate, "match_ratio": args.match_ratio, "disconnect_every": args.disconnect_every,
+            "settle": args.settle, "settle_timeout": args.settle_timeout, "seed": args.seed
+        }))
+        os.chdir(repo_dir)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import secrets
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from anwer_status_page import anwer_render_status_page
+
+logger = logging.getLogger(__name__)
+
+# عدد مرات إعادة تشغيل العامل المتوقف قبل اعتباره ميتاً وتوزيع مستخدميه على بقية العمال
+ANWER_SHARD_MAX_RESTARTS = 3
+ANWER_SHARD_RESTART_WINDOW = 300
+ANWER_SHARD_CHECK_INTERVAL = 2
+
+# مهلة انتظار العامل حتى ينهي إغلاقه المنظم (تفريغ الطوابير وقطع الاتصالات) بعد SIGTERM
+ANWER_SHARD_STOP_TIMEOUT = 30
+
+# ترويسات خاصة بالاتصال نفسه لا تُمرَّر عبر الوسيط
+ANWER_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host"
+}
+
+# العمال: {رقم العامل: {"process", "socket", "client", "restarts"}}
+anwer_shards = {}
+anwer_shard_alive = []
+
+# العمال الذين لم يستلموا قائمة الأحياء الأخيرة بعد (يُعاد إبلاغهم في كل دورة فحص)
+anwer_shard_pending = set()
+
+anwer_shards_started_at = time.time()
+
+# مفتاح المسار الداخلي للعمال (يتغير مع كل تشغيل للواجهة الأمامية)
+ANWER_SHARD_TOKEN = secrets.token_hex(16)
+
+def anwer_shard_owner(user_id, shard_ids):
+    """العامل المالك للمستخدم (Rendezvous hashing: أقل نقل للمستخدمين عند تغيّر العمال)"""
+    return max(
+        shard_ids,
+        key=lambda shard_id: hashlib.sha1(f"{shard_id}:{user_id}".encode()).digest()
+    )
+
+def anwer_run_shard_worker(shard_index, shard_count, socket_path, shard_alive, token):
+    """تشغيل تطبيق Anwer كاملاً داخل عملية عامل مستقلة"""
+    os.environ["ANWER_SHARD_INDEX"] = str(shard_index)
+    os.environ["ANWER_SHARD_COUNT"] = str(shard_count)
+    os.environ["ANWER_SHARD_ALIVE"] = ",".join(map(str, shard_alive))
+    os.environ["ANWER_SHARD_TOKEN"] = token
+
+    import uvicorn
+    from anwer_bot import app
+
+    uvicorn.run(app, uds=socket_path, log_level="warning", timeout_graceful_shutdown=5)
+
+def anwer_start_shard(shard_index, shard_count):
+    """تشغيل عملية العامل وتجهيز الاتصال المحلي بها"""
+    shard = anwer_shards.setdefault(shard_index, {"restarts": []})
+    socket_path = str(Path(tempfile.gettempdir()) / f"anwer_shard_{os.getpid()}_{shard_index}.sock")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=anwer_run_shard_worker,
+        args=(shard_index, shard_count, socket_path, list(anwer_shard_alive), ANWER_SHARD_TOKEN),
+        name=f"anwer-shard-{shard_index}",
+        daemon=True
+    )
+    process.start()
+
+    shard.update({
+        "process": process,
+        "socket": socket_path,
+        "client": httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=socket_path),
+            base_url="http://anwer-shard",
+            timeout=httpx.Timeout(None, connect=5)
+        )
+    })
+    logger.info(f"🧩 تم تشغيل العامل {shard_index} (pid {process.pid})")
+
+async def anwer_broadcast_shard_membership():
+    """إبلاغ العمال بقائمة العمال الأحياء بعد إعادة التوزيع (من فشل إبلاغه يبقى للدورة التالية)"""
+    for shard_index in sorted(anwer_shard_pending):
+        if shard_index not in anwer_shard_alive:
+            anwer_shard_pending.discard(shard_index)
+            continue
+        try:
+            response = await anwer_shards[shard_index]["client"].post(
+                "/anwer_internal/shards", json={"alive": anwer_shard_alive},
+                headers={"X-Anwer-Shard-Token": ANWER_SHARD_TOKEN}
+            )
+            response.raise_for_status()
+            anwer_shard_pending.discard(shard_index)
+        except Exception as e:
+            logger.error(f"خطأ في إبلاغ العامل {shard_index}: {e}")
+
+async def anwer_fetch_shards_status():
+    """حالة كل عامل حي من /status الخاص به (العامل الذي لا يرد يُعد غير حي)"""
+    shards = {}
+    for shard_index in list(anwer_shard_alive):
+        try:
+            response = await anwer_shards[shard_index]["client"].get("/status")
+            shards[shard_index] = response.json()
+        except (httpx.TransportError, ValueError) as e:
+            logger.error(f"خطأ في جلب حالة العامل {shard_index}: {e}")
+            shards[shard_index] = {"status": "error", "alive": False, "ready": False}
+    return shards
+
+def anwer_merge_shards_status(shards):
+    """جمع حالة العمال في ملخص واحد بشكل حالة العملية الواحدة (لصفحة الحالة)"""
+    def total(section, key=None):
+        # العامل الذي لم يرد حالته بلا أرقام
+        return sum(
+            (shard.get(section) or {}).get(key, 0) if key else shard.get(section, 0)
+            for shard in shards.values()
+        )
+
+    return {
+        "alive": bool(shards) and all(shard.get("alive") for shard in shards.values()),
+        "ready": bool(shards) and all(shard.get("ready") for shard in shards.values()),
+        "uptime_seconds": int(time.time() - anwer_shards_started_at),
+        "readiness": {
+            "sessions_restored": total("readiness", "sessions_restored"),
+            "sessions_total": total("readiness", "sessions_total")
+        },
+        "clients": {"connected": total("clients", "connected"), "total": total("clients", "total")},
+        "monitoring": {"running": total("monitoring", "running"), "enabled": total("monitoring", "enabled")},
+        "auto_send_scheduled": total("auto_send_scheduled")
+    }
+
+async def anwer_shard_supervisor(shard_count):
+    """إعادة تشغيل العمال المتوقفين، وتوزيع مستخدمي العامل الميت على البقية"""
+    while True:
+        await asyncio.sleep(ANWER_SHARD_CHECK_INTERVAL)
+        for shard_index in list(anwer_shard_alive):
+            shard = anwer_shards[shard_index]
+            if shard["process"].is_alive():
+                continue
+
+            logger.error(f"⚠️ توقف العامل {shard_index} (exit code {shard['process'].exitcode})")
+            await shard["client"].aclose()
+
+            now = time.monotonic()
+            shard["restarts"] = [t for t in shard["restarts"] if now - t < ANWER_SHARD_RESTART_WINDOW]
+            if len(shard["restarts"]) < ANWER_SHARD_MAX_RESTARTS:
+                # العامل الجديد يبدأ بقائمة الأحياء الحالية، فلا يحتاج إبلاغاً إلا إن تغيّرت لاحقاً
+                shard["restarts"].append(now)
+                anwer_shard_pending.discard(shard_index)
+                anwer_start_shard(shard_index, shard_count)
+            else:
+                anwer_shard_alive.remove(shard_index)
+                anwer_shard_pending.update(anwer_shard_alive)
+                logger.error(f"❌ العامل {shard_index} خارج الخدمة، توزيع مستخدميه على {anwer_shard_alive}")
+
+        if anwer_shard_pending:
+            await anwer_broadcast_shard_membership()
+
+def anwer_create_shard_app(shard_count):
+    """الواجهة الأمامية: توجيه طلبات كل مستخدم إلى العامل المالك له"""
+
+    @asynccontextmanager
+    async def anwer_shard_lifespan(app):
+        anwer_shard_alive[:] = range(shard_count)
+        for shard_index in range(shard_count):
+            anwer_start_shard(shard_index, shard_count)
+        supervisor_task = asyncio.create_task(anwer_shard_supervisor(shard_count))
+        try:
+            yield
+        finally:
+            supervisor_task.cancel()
+            for shard in anwer_shards.values():
+                await shard["client"].aclose()
+                shard["process"].terminate()
+            for shard in anwer_shards.values():
+                shard["process"].join(timeout=ANWER_SHARD_STOP_TIMEOUT)
+                if os.path.exists(shard["socket"]):
+                    os.unlink(shard["socket"])
+
+    app = FastAPI(lifespan=anwer_shard_lifespan)
+
+    @app.get("/anwer")
+    async def anwer_home():
+        """الصفحة الرئيسية لمراقب Anwer"""
+        return RedirectResponse(f"/anwer/{uuid.uuid4()}", status_code=303)
+
+    @app.get("/health")
+    async def anwer_health():
+        """حياة الواجهة الأمامية: يوجد عامل واحد حي على الأقل"""
+        if not anwer_shard_alive:
+            return JSONResponse({"status": "error", "message": "لا يوجد عمال متاحون"}, status_code=503)
+        return JSONResponse({"status": "ok", "alive": anwer_shard_alive})
+
+    @app.get("/ready")
+    @app.get("/status")
+    async def anwer_shards_status(request: Request):
+        """حالة كل عامل حي؛ الخدمة جاهزة عندما تكون جميع العمال جاهزة"""
+        shards = await anwer_fetch_shards_status()
+        ready = bool(shards) and all(shard.get("ready") for shard in shards.values())
+        status_code = 200 if ready or request.url.path == "/status" else 503
+        return JSONResponse({"status": "success" if ready else "starting", "ready": ready, "shards": shards},
+                            status_code=status_code)
+
+    @app.get("/", response_class=HTMLResponse)
+    async def anwer_status_page():
+        """صفحة حالة السيرفر بمجموع أرقام العمال"""
+        shards = await anwer_fetch_shards_status()
+        return anwer_render_status_page(anwer_merge_shards_status(shards), workers=(len(shards), shard_count))
+
+    @app.get("/metrics")
+    async def anwer_metrics():
+        """دمج مقاييس جميع العمال في استجابة واحدة بصيغة Prometheus"""
+        families = {}
+        for shard_index in list(anwer_shard_alive):
+            try:
+                response = await anwer_shards[shard_index]["client"].get("/metrics")
+            except httpx.TransportError as e:
+                logger.error(f"خطأ في جلب مقاييس العامل {shard_index}: {e}")
+                continue
+
+            # كل عامل يرسل ترويسة HELP/TYPE لكل مقياس، تُكتب مرة واحدة وتُجمع عيّنات العمال تحتها
+            family = None
+            for line in response.text.splitlines():
+                if line.startswith("# HELP "):
+                    family = families.setdefault(line.split()[2], {"header": [], "samples": []})
+                    if not family["header"]:
+                        family["header"].append(line)
+                elif line.startswith("# TYPE "):
+                    if len(family["header"]) < 2:
+                        family["header"].append(line)
+                elif line and family is not None:
+                    family["samples"].append(line)
+
+        lines = [line for family in families.values() for line in family["header"] + family["samples"]]
+        return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.api_route("/anwer/{user_id}", methods=["GET", "POST"])
+    @app.api_route("/anwer/{user_id}/{path:path}", methods=["GET", "POST"])
+    async def anwer_proxy(request: Request, user_id: str):
+        """تمرير الطلب إلى العامل المالك للمستخدم"""
+        if not anwer_shard_alive:
+            return JSONResponse({"status": "error", "message": "لا يوجد عمال متاحون"}, status_code=503)
+
+        shard_index = anwer_shard_owner(user_id, anwer_shard_alive)
+        client = anwer_shards[shard_index]["client"]
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in ANWER_HOP_HEADERS]
+
+        try:
+            upstream = await client.send(
+                client.build_request(
+                    request.method, request.url.path, params=request.query_params,
+                    headers=headers, content=await request.body()
+                ),
+                stream=True
+            )
+        except httpx.TransportError as e:
+            logger.error(f"خطأ في الاتصال بالعامل {shard_index}: {e}")
+            return JSONResponse({"status": "error", "message": "العامل غير متاح مؤقتاً"}, status_code=503)
+
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in ANWER_HOP_HEADERS},
+            background=BackgroundTask(upstream.aclose)
+        )
+
+    return app
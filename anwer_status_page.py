@@ -0,0 +1,71 @@
+from fastapi.responses import HTMLResponse
+
+# تنسيق صفحة حالة السيرفر
+ANWER_STATUS_PAGE_STYLE = """
+        body {
+            font-family: Arial, sans-serif;
+            text-align: center;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 50px;
+            margin: 0;
+        }
+        .status-card {
+            background: rgba(255,255,255,0.1);
+            border-radius: 15px;
+            padding: 30px;
+            max-width: 400px;
+            margin: 0 auto;
+            backdrop-filter: blur(10px);
+            box-shadow: 0 8px 32px rgba(0,0,0,0.1);
+        }
+        .icon {
+            font-size: 48px;
+            margin-bottom: 20px;
+        }
+        .status {
+            font-size: 24px;
+            font-weight: bold;
+            margin-bottom: 10px;
+        }
+        .details {
+            font-size: 16px;
+            opacity: 0.8;
+            line-height: 1.8;
+        }
+"""
+
+def anwer_render_status_page(status, workers=None):
+    """صفحة حالة السيرفر (لـ UptimeRobot والمتابعة السريعة) من ملخص الحالة:
+    حالة عملية واحدة، أو مجموع العمال مع (الأحياء، العدد الكلي) في وضع العمال المتعددين"""
+    if not status["alive"]:
+        icon, headline = "❌", "السيرفر يعمل بشكل غير سليم"
+    elif not status["ready"]:
+        icon, headline = "⏳", "السيرفر قيد الإقلاع"
+    else:
+        icon, headline = "✅", "السيرفر يعمل بنجاح"
+
+    hours, remainder = divmod(status["uptime_seconds"], 3600)
+    readiness = status["readiness"]
+    workers_line = f"العمال الأحياء: {workers[0]} من {workers[1]}<br>\n            " if workers else ""
+    return HTMLResponse(f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>🤖 Anwer - حالة السيرفر</title>
+    <meta charset="UTF-8">
+    <style>{ANWER_STATUS_PAGE_STYLE}</style>
+</head>
+<body>
+    <div class="status-card">
+        <div class="icon">🤖</div>
+        <div class="status">{icon} {headline}</div>
+        <div class="details">
+            {workers_line}مدة التشغيل: {hours} ساعة و {remainder // 60} دقيقة<br>
+            الحسابات المتصلة: {status["clients"]["connected"]} من {status["clients"]["total"]}<br>
+            المراقبة تعمل: {status["monitoring"]["running"]} من {status["monitoring"]["enabled"]}<br>
+            الجلسات المستعادة: {readiness["sessions_restored"]} من {readiness["sessions_total"]}<br>
+            الإرسال التلقائي المجدول: {status["auto_send_scheduled"]}
+        </div>
+    </div>
+</body>
+</html>""", status_code=200 if status["alive"] else 503)
@@ -28,14 +28,23 @@ def main():
     try:
         logger.info("🚀 بدء تشغيل Anwer Bot...")
         
-        # استيراد وتشغيل البوت
-        from anwer_bot import app
         import uvicorn
         
         # الحصول على المنفذ من متغير البيئة أو استخدام 4000
         port = int(os.environ.get("PORT", 4000))
         host = os.environ.get("HOST", "0.0.0.0")
         
+        # عدد العمال: أكثر من واحد يوزع الحسابات على عمليات منفصلة
+        workers = int(os.environ.get("ANWER_WORKERS", 1))
+        
+        # استيراد وتشغيل البوت
+        if workers > 1:
+            from anwer_shards import anwer_create_shard_app
+            app = anwer_create_shard_app(workers)
+            logger.info(f"🧩 وضع العمال المتعددين: {workers} عمال")
+        else:
+            from anwer_bot import app
+        
         logger.info(f"🌐 تشغيل السيرفر على {host}:{port}")
         
         # تشغيل السيرفر
@@ -44,7 +53,9 @@ def main():
             host=host, 
             port=port,
             log_level="info",
-            access_log=True
+            access_log=True,
+            # عدم انتظار بث الأحداث المفتوح أكثر من 5 ثوانٍ قبل الإغلاق المنظم للبوت
+            timeout_graceful_shutdown=5
         )
         
     except Exception as e: